@@ -0,0 +1,56 @@
+import asyncio
+import logging
+
+from background import BackgroundJob
+from database import archive_listings, compact_database
+from metrics import Counter
+
+log = logging.getLogger(__name__)
+
+# Фоновый перенос старых объявлений в таблицу listings_archive. Переносим
+# небольшими пачками, каждая — короткая транзакция записи, чтобы не задерживать
+# обработчики. После переноса база понемногу освобождает страницы.
+
+# Отклонённые объявления хранятся в основной таблице неделю
+REJECTED_TTL_DAYS = 7
+# Одобренные снимаются с витрины через три месяца после публикации
+APPROVED_TTL_DAYS = 90
+ARCHIVE_BATCH = 500
+# Пауза между пачками, секунды
+BATCH_PAUSE = 0.5
+ARCHIVE_INTERVAL = 60 * 60
+# Сколько свободных страниц возвращать за один проход
+VACUUM_PAGES = 1000
+
+ARCHIVED = Counter('bot_listings_archived_total', 'Объявления, перенесённые в архив', ['reason'])
+
+
+class ArchiveJob(BackgroundJob):
+    failure_message = 'Не удалось перенести объявления в архив'
+
+    def __init__(self, interval=ARCHIVE_INTERVAL, batch_size=ARCHIVE_BATCH, rejected_ttl=REJECTED_TTL_DAYS,
+                 approved_ttl=APPROVED_TTL_DAYS):
+        super().__init__(interval)
+        self.batch_size = batch_size
+        self.ttl = {'rejected': rejected_ttl, 'expired': approved_ttl}
+
+    async def step(self):
+        await self.run_once()
+
+    # Один проход: переносит всё накопившееся и сжимает базу.
+    # Возвращает {причина: число перенесённых}
+    async def run_once(self):
+        archived = {}
+        for reason, days in self.ttl.items():
+            archived[reason] = 0
+            while not self.stopping():
+                ids = await archive_listings(reason, f'-{days} days', self.batch_size)
+                archived[reason] += len(ids)
+                ARCHIVED.inc(reason, amount=len(ids))
+                if len(ids) < self.batch_size:
+                    break
+                await asyncio.sleep(BATCH_PAUSE)
+        if any(archived.values()):
+            log.info('Перенесено в архив: %s', archived)
+        await compact_database(VACUUM_PAGES)
+        return archived
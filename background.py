@@ -0,0 +1,77 @@
+import asyncio
+import logging
+
+
+# Фоновая задача процесса бота: step() повторяется, пока задачу не остановят.
+# step() возвращает паузу до следующего шага: None — interval секунд, которые
+# прерывает wake(); число — ровно столько секунд (wake() их не сокращает),
+# 0 — следующий шаг сразу. close() дожидается текущего шага.
+class BackgroundJob:
+    # Что писать в лог, если шаг упал
+    failure_message = 'Ошибка в фоновой задаче'
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._wakeup = None
+        self._stop = None
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._stop = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+
+    # Выполнить следующий шаг сейчас, не дожидаясь interval
+    def wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def stopping(self):
+        return self._stop is not None and self._stop.is_set()
+
+    async def step(self):
+        raise NotImplementedError
+
+    async def _run(self):
+        while not self._stop.is_set():
+            try:
+                pause = await self.step()
+            except Exception:
+                # В лог модуля конкретной задачи
+                logging.getLogger(type(self).__module__).exception(self.failure_message)
+                pause = None
+            if pause is None:
+                await self._wait(self._wakeup, self.interval)
+                self._wakeup.clear()
+            elif pause > 0:
+                await self._wait(self._stop, pause)
+
+    @staticmethod
+    async def _wait(event, seconds):
+        try:
+            await asyncio.wait_for(event.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def close(self, timeout=10):
+        if self._task is None:
+            return
+        self._stop.set()
+        self.wake()
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._task = None
+
+
+# Вызывает корутину fn раз в interval секунд
+class PeriodicTask(BackgroundJob):
+    def __init__(self, fn, interval, failure_message=BackgroundJob.failure_message):
+        super().__init__(interval)
+        self.fn = fn
+        self.failure_message = failure_message
+
+    async def step(self):
+        await self.fn()
@@ -0,0 +1,263 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+# Микробенчмарки функций database.py на базах разного размера. Для каждого
+# размера создаётся (или берётся готовая) база с распределениями из seed.py,
+# каждая функция вызывается со случайными параметрами, а по росту медианы
+# между размерами видно, какая функция перестаёт масштабироваться.
+#
+#     python -m benchmarks.db_bench --sizes 10000 100000 1000000 --json bench.json
+#     python -m benchmarks.db_bench --compare bench.json --json bench2.json
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+# Не больше стольких вызовов и секунд на функцию, но не меньше MIN_CALLS вызовов
+ITERATIONS = 200
+BUDGET = 2.0
+MIN_CALLS = 3
+WARMUP = 3
+# Показатель роста времени от размера базы: 0 — не зависит, 1 — линейно.
+# Выше порога функция считается немасштабируемой
+SCALING_THRESHOLD = 0.5
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def summarize(latencies):
+    return {
+        'calls': len(latencies),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 4),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 4),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 4),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 4),
+        'min_ms': round(min(latencies) * 1000, 4),
+        'max_ms': round(max(latencies) * 1000, 4),
+    }
+
+
+# Сценарии: имя -> фабрика корутины со случайными параметрами.
+# Имена совпадают с функциями database.py, в скобках — вариант вызова
+def make_cases(database, rng, users, max_id):
+    categories = ('electronics', 'clothing', 'food', 'other')
+
+    async def catalog_next(sort):
+        rows, _, has_next = await database.get_catalog_page(rng.choice(categories), 5, 'first', None, sort)
+        if has_next:
+            await database.get_catalog_page(rows[-1][4], 5, 'next', rows[-1][0], sort)
+
+    return {
+        'add_listing': lambda: database.add_listing(
+            rng.randint(1, users), f'Бенчмарк {rng.randrange(10 ** 6)}', 'Описание для бенчмарка', None,
+            rng.choice(categories), 2000.0, 1500.0, 1
+        ),
+        'get_approved_listings()': lambda: database.get_approved_listings(),
+        'get_approved_listings(category)': lambda: database.get_approved_listings(rng.choice(categories)),
+        'get_approved_listings(category, limit)': lambda: database.get_approved_listings(
+            rng.choice(categories), limit=5),
+        'get_catalog_page(first+next)': lambda: catalog_next('new'),
+        'get_catalog_page(discount, first+next)': lambda: catalog_next('discount'),
+        'get_pending_listings': lambda: database.get_pending_listings(),
+        'get_moderation_page': lambda: database.get_moderation_page(10, 'first', None),
+        'get_user_listings': lambda: database.get_user_listings(rng.randint(1, users)),
+        'get_listing_by_id': lambda: database.get_listing_by_id(rng.randint(1, max_id)),
+        'get_user_role': lambda: database.get_user_role(rng.randint(1, users)),
+        'get_statistics': lambda: database.get_statistics(),
+    }
+
+
+async def measure(factory, iterations, budget):
+    for _ in range(WARMUP):
+        await factory()
+    latencies = []
+    deadline = time.perf_counter() + budget
+    while len(latencies) < iterations and (len(latencies) < MIN_CALLS or time.perf_counter() < deadline):
+        started = time.perf_counter()
+        await factory()
+        latencies.append(time.perf_counter() - started)
+    return summarize(latencies)
+
+
+def prepare_database(path, size, seed):
+    from benchmarks.seed import seed_database
+    from database import init_db
+
+    if os.path.exists(path):
+        conn = sqlite3.connect(path)
+        try:
+            listings = conn.execute("SELECT value FROM stats_counters WHERE key = 'listings'").fetchone()
+        except sqlite3.Error:
+            listings = None
+        conn.close()
+        if listings and listings[0] == size:
+            # Готовая база: только недостающие миграции
+            init_db(path)
+            return 0.0
+        os.remove(path)
+    started = time.perf_counter()
+    seed_database(path, size, seed)
+    return time.perf_counter() - started
+
+
+async def bench_size(database, path, size, args):
+    users = max(1, size // 5)
+    database.db.path = path
+    database.role_cache.clear()
+    database.catalog.clear()
+    max_id = (await database.db.fetchone('SELECT MAX(id) FROM listings'))[0]
+    rng = random.Random(args.seed)
+    cases = make_cases(database, rng, users, max_id)
+    if args.only:
+        cases = {name: factory for name, factory in cases.items() if any(part in name for part in args.only)}
+
+    results = {}
+    for name, factory in cases.items():
+        if name == 'add_listing':
+            continue
+        results[name] = await measure(factory, args.iterations, args.budget)
+        print(f'{size:>9}  {name:<48} p50 {results[name]["p50_ms"]:>10.3f} ms')
+
+    # Те же чтения из модели каталога в памяти
+    model_cases = [name for name in cases if name.startswith(('get_approved_listings', 'get_catalog_page'))]
+    if model_cases or not args.only or any(part in 'load_catalog' for part in args.only):
+        started = time.perf_counter()
+        await database.load_catalog()
+        load_seconds = time.perf_counter() - started
+        database.catalog.clear()
+        tracemalloc.start()
+        await database.load_catalog()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results['load_catalog'] = {
+            'calls': 1, 'p50_ms': round(load_seconds * 1000, 4), 'listings': len(database.catalog),
+            'memory_mb': round(memory / 2 ** 20, 2),
+            'bytes_per_listing': round(memory / len(database.catalog)) if len(database.catalog) else 0,
+        }
+        print(f'{size:>9}  {"load_catalog":<48} p50 {results["load_catalog"]["p50_ms"]:>10.3f} ms')
+        for name in model_cases:
+            key = name + '[model]'
+            results[key] = await measure(cases[name], args.iterations, args.budget)
+            print(f'{size:>9}  {key:<48} p50 {results[key]["p50_ms"]:>10.3f} ms')
+        database.catalog.clear()
+
+    # Запись последней: добавленные объявления удаляются, чтобы базу можно было переиспользовать
+    if 'add_listing' in cases:
+        results['add_listing'] = await measure(cases['add_listing'], args.iterations, args.budget)
+        print(f'{size:>9}  {"add_listing":<48} p50 {results["add_listing"]["p50_ms"]:>10.3f} ms')
+        await database.db.execute('DELETE FROM listings WHERE id > ?', (max_id,))
+    database.db.close()
+    return results
+
+
+# Показатель роста медианы между соседними размерами и размер, с которого
+# функция перестаёт масштабироваться
+def scaling(results):
+    sizes = sorted(results, key=int)
+    report = {}
+    for name in results[sizes[0]]:
+        exponents = {}
+        stops_at = None
+        for smaller, larger in zip(sizes, sizes[1:]):
+            if name not in results[larger]:
+                continue
+            before, after = results[smaller][name]['p50_ms'], results[larger][name]['p50_ms']
+            exponent = math.log(max(after, 1e-6) / max(before, 1e-6)) / math.log(int(larger) / int(smaller))
+            exponents[larger] = round(exponent, 2)
+            if stops_at is None and exponent > SCALING_THRESHOLD:
+                stops_at = larger
+        report[name] = {'exponents': exponents, 'stops_scaling_at': stops_at}
+    return report
+
+
+def print_report(results, report):
+    sizes = sorted(results, key=int)
+    print()
+    print(f'{"функция":<48}' + ''.join(f'{size:>12}' for size in sizes) + '   рост')
+    for name, info in report.items():
+        cells = ''.join(
+            f'{results[size][name]["p50_ms"]:>12.3f}' if name in results[size] else f'{"—":>12}' for size in sizes
+        )
+        exponents = ' '.join(f'{value:+.2f}' for value in info['exponents'].values())
+        flag = f'  ⚠ не масштабируется с {info["stops_scaling_at"]}' if info['stops_scaling_at'] else ''
+        print(f'{name:<48}{cells}   {exponents}{flag}')
+    print('(медиана, мс; рост — показатель степени между соседними размерами: 0 — постоянно, 1 — линейно)')
+
+
+def print_comparison(results, previous):
+    print()
+    print('Сравнение с предыдущим запуском (медиана, новое / старое):')
+    for size, helpers in results.items():
+        for name, stats in helpers.items():
+            old = previous.get('results', {}).get(size, {}).get(name)
+            if old and old['p50_ms']:
+                ratio = stats['p50_ms'] / old['p50_ms']
+                mark = '  ⚠' if ratio > 1.2 else ''
+                print(f'{size:>9}  {name:<48} {old["p50_ms"]:>10.3f} → {stats["p50_ms"]:>10.3f} ms  ×{ratio:.2f}{mark}')
+
+
+async def run(args, workdir):
+    import database
+
+    results = {}
+    seeding = {}
+    for size in args.sizes:
+        path = os.path.join(workdir, f'marketplace_bot_{size}.db')
+        print(f'База на {size} объявлений: {path}')
+        seeding[str(size)] = round(prepare_database(path, size, args.seed), 2)
+        results[str(size)] = await bench_size(database, path, size, args)
+    return results, seeding
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Микробенчмарки функций работы с базой')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help='размеры баз')
+    parser.add_argument('--workdir', default=None,
+                        help='каталог для баз; готовые базы нужного размера используются повторно')
+    parser.add_argument('--iterations', type=int, default=ITERATIONS)
+    parser.add_argument('--budget', type=float, default=BUDGET, help='секунд на функцию')
+    parser.add_argument('--only', nargs='+', default=None, help='только функции, имя которых содержит строку')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, help='сохранить результаты в файл')
+    parser.add_argument('--compare', default=None, help='сравнить с результатами предыдущего запуска')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='db_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    results, seeding = asyncio.run(run(args, workdir))
+    report = scaling(results) if len(results) > 1 else {}
+    print_report(results, report)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(results, json.load(f))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'meta': {
+                    'date': datetime.now().isoformat(timespec='seconds'),
+                    'python': platform.python_version(),
+                    'sqlite': sqlite3.sqlite_version,
+                    'platform': platform.platform(),
+                    'iterations': args.iterations,
+                    'budget': args.budget,
+                    'seed_seconds': seeding,
+                },
+                'results': results,
+                'scaling': report,
+            }, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import asyncio
+import collections
+import itertools
+import json
+import time
+
+from aiohttp import web
+
+# Локальная замена Bot API для нагрузочных тестов. Отдаёт боту обновления
+# через getUpdates и запоминает всё, что бот отправляет в ответ.
+
+BOT_INFO = {'id': 1, 'is_bot': True, 'first_name': 'Load test bot', 'username': 'load_test_bot'}
+
+
+class FakeBotAPI:
+    def __init__(self):
+        self.updates = collections.deque()
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.new_updates = asyncio.Event()
+        self.calls = collections.Counter()
+        # chat_id -> последние отправленные ботом сообщения (для сценариев)
+        self.outbox = collections.defaultdict(lambda: collections.deque(maxlen=50))
+        self.app = web.Application()
+        self.app.router.add_post('/bot{token}/{method}', self.handle)
+        self._runner = None
+
+    async def start(self, host='127.0.0.1', port=8081):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        return f'http://{host}:{port}'
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def push(self, update):
+        update['update_id'] = next(self.update_ids)
+        self.updates.append(update)
+        self.new_updates.set()
+        return update['update_id']
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        self.calls[method] += 1
+        data = dict(await request.post())
+        handler = getattr(self, 'api_' + method.lower(), None)
+        result = await handler(data) if handler else True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def api_getme(self, data):
+        return BOT_INFO
+
+    async def api_getupdates(self, data):
+        offset = int(data.get('offset') or 0)
+        limit = int(data.get('limit') or 100)
+        timeout = float(data.get('timeout') or 0)
+        while self.updates and self.updates[0]['update_id'] < offset:
+            self.updates.popleft()
+        if not self.updates and timeout:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(itertools.islice(self.updates, limit))
+
+    def _message(self, data, **extra):
+        chat_id = int(data.get('chat_id', 0))
+        message = {
+            'message_id': int(data.get('message_id') or next(self.message_ids)),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_INFO,
+        }
+        message.update(extra)
+        if 'reply_markup' in data:
+            markup = json.loads(data['reply_markup'])
+            if 'inline_keyboard' in markup:
+                message['reply_markup'] = markup
+        self.outbox[chat_id].append(message)
+        return message
+
+    async def api_sendmessage(self, data):
+        return self._message(data, text=data.get('text', ''))
+
+    async def api_editmessagetext(self, data):
+        return self._message(data, text=data.get('text', ''))
+
+    async def api_editmessagereplymarkup(self, data):
+        return self._message(data, text='')
+
+    async def api_sendphoto(self, data):
+        photo = [{'file_id': data.get('photo', ''), 'file_unique_id': 'x', 'width': 1, 'height': 1}]
+        return self._message(data, photo=photo, caption=data.get('caption', ''))
+
+    async def api_senddocument(self, data):
+        return self._message(data, document={'file_id': 'doc', 'file_unique_id': 'doc'})
+
+    async def api_sendmediagroup(self, data):
+        media = json.loads(data.get('media', '[]'))
+        return [
+            self._message(data, photo=[{'file_id': item.get('media', ''), 'file_unique_id': 'x',
+                                        'width': 1, 'height': 1}])
+            for item in media
+        ]
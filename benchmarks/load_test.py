@@ -0,0 +1,264 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+# Нагрузочный тест бота без Telegram: бот работает в этом же процессе
+# в режиме polling и ходит в локальный FakeBotAPI, а виртуальные
+# пользователи проходят сценарии /start, каталог, создание объявления
+# и модерацию.
+#
+#     python -m benchmarks.load_test --listings 100000 --users 2000
+#
+# Отчёт: обновлений в секунду, p50/p99 времени обработки обновления
+# и число исходящих вызовов Bot API на одно обновление.
+
+FAKE_TOKEN = '123456:load-test-token'
+PASSIVE_METHODS = {'getUpdates', 'getMe', 'deleteWebhook'}
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+# Замеряет время обработки каждого обновления и сообщает сценарию, что бот закончил
+class LatencyRecorder(BaseMiddleware):
+    def __init__(self):
+        super().__init__()
+        self.latencies = []
+        self.waiters = {}
+
+    async def on_pre_process_update(self, update, data):
+        data['load_test_started'] = time.perf_counter()
+
+    async def on_post_process_update(self, update, result, data):
+        self.latencies.append(time.perf_counter() - data['load_test_started'])
+        waiter = self.waiters.pop(update.update_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(result)
+
+
+class VirtualUser:
+    message_ids = itertools.count(1)
+
+    def __init__(self, harness, user_id):
+        self.harness = harness
+        self.user_id = user_id
+        self.user = {'id': user_id, 'is_bot': False, 'first_name': f'VU {user_id}', 'username': f'vu{user_id}'}
+
+    async def send(self, text):
+        message = {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': self.user_id, 'type': 'private'},
+            'from': self.user,
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        await self.harness.deliver({'message': message})
+
+    async def press(self, message, callback_data):
+        await self.harness.deliver({'callback_query': {
+            'id': str(next(self.message_ids)),
+            'from': self.user,
+            'chat_instance': str(self.user_id),
+            'message': message,
+            'data': callback_data,
+        }})
+
+    # Последнее сообщение бота с inline-кнопкой, подходящей под условие
+    def find_button(self, predicate):
+        for message in reversed(self.harness.api.outbox[self.user_id]):
+            for row in message.get('reply_markup', {}).get('inline_keyboard', []):
+                for button in row:
+                    if predicate(button.get('callback_data', '')):
+                        return message, button['callback_data']
+        return None, None
+
+
+async def scenario_start(vu):
+    await vu.send('/start')
+
+
+async def scenario_browse(vu, rng, pages=3):
+    await vu.send('📱 Каталог товаров')
+    category = rng.choice(['electronics', 'clothing', 'food', 'other'])
+    message, data = vu.find_button(lambda d: d == f'category_{category}')
+    if message is None:
+        return
+    await vu.press(message, data)
+    for _ in range(pages):
+        message, data = vu.find_button(lambda d: d.startswith('page:') and ':next:' in d)
+        if message is None:
+            break
+        await vu.press(message, data)
+
+
+async def scenario_wizard(vu, rng):
+    await vu.send('➕ Добавить объявление')
+    await vu.send(f'Товар {rng.randrange(10 ** 6)}')
+    await vu.send('Описание товара для нагрузочного теста')
+    await vu.send('⏭️ Пропустить фото')
+    await vu.send(rng.choice(['📱 Электроника', '🍕 Питание', '👕 Одежда', '🔧 Разное']))
+    await vu.send(str(rng.randint(1000, 5000)))
+    await vu.send(str(rng.randint(100, 999)))
+    await vu.send(str(rng.randint(1, 10)))
+
+
+async def scenario_moderate(vu, rng, pages=3):
+    await vu.send('📝 Ожидающие модерации')
+    for _ in range(pages):
+        for _ in range(rng.randint(1, 3)):
+            message, data = vu.find_button(lambda d: d.startswith('mod:toggle:'))
+            if message is None:
+                return
+            toggles = [button['callback_data'] for row in message['reply_markup']['inline_keyboard']
+                       for button in row if button['callback_data'].startswith('mod:toggle:')]
+            await vu.press(message, rng.choice(toggles))
+        message, data = vu.find_button(lambda d: d.startswith('mod:approve:') or d.startswith('mod:reject:'))
+        if message is None:
+            return
+        action = rng.choice(['approve', 'reject'])
+        await vu.press(message, f'mod:{action}:0')
+
+
+class Harness:
+    def __init__(self, api, recorder, timeout):
+        self.api = api
+        self.recorder = recorder
+        self.timeout = timeout
+        self.delivered = 0
+        self.timeouts = 0
+
+    async def deliver(self, update):
+        waiter = asyncio.get_running_loop().create_future()
+        update_id = self.api.push(update)
+        self.recorder.waiters[update_id] = waiter
+        self.delivered += 1
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.recorder.waiters.pop(update_id, None)
+
+
+async def run(args):
+    from benchmarks.fake_bot_api import FakeBotAPI
+
+    api = FakeBotAPI()
+    server = await api.start(port=args.port)
+
+    # Настройки бота должны быть заданы до импорта main
+    workdir = tempfile.mkdtemp(prefix='load_test_')
+    db_path = args.db or os.path.join(workdir, 'marketplace_bot.db')
+    os.environ.update(
+        BOT_TOKEN=FAKE_TOKEN,
+        BOT_API_SERVER=server,
+        DB_PATH=db_path,
+        FSM_STORAGE_PATH=os.path.join(workdir, 'fsm_storage.db'),
+    )
+    from benchmarks.seed import ADMINS, seed_database
+    import main
+    import sender
+
+    if not args.db:
+        print(f'Заполнение базы: {args.listings} объявлений...')
+        seed_database(db_path, args.listings, args.seed)
+    main.init_db()
+    if not args.sql_catalog:
+        await main.load_catalog()
+    if not args.telegram_limits:
+        main.bot.scheduler = sender.OutboundScheduler(1e9, 1e9, 1e9, 1e9, workers=64)
+    main.outbox.start()
+
+    recorder = LatencyRecorder()
+    main.dp.middleware.setup(recorder)
+    polling = asyncio.ensure_future(main.dp.start_polling(timeout=1, relax=0))
+
+    harness = Harness(api, recorder, args.timeout)
+    rng = random.Random(args.seed)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def user_session(index):
+        async with semaphore:
+            if index < args.admins:
+                vu = VirtualUser(harness, 1 + index % ADMINS)
+                await scenario_moderate(vu, rng)
+                return
+            vu = VirtualUser(harness, 10 ** 9 + index)
+            await scenario_start(vu)
+            await scenario_browse(vu, rng)
+            if rng.random() < args.wizard_share:
+                await scenario_wizard(vu, rng)
+
+    api.calls.clear()
+    started = time.perf_counter()
+    await asyncio.gather(*(user_session(index) for index in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    main.dp.stop_polling()
+    await polling
+    await main.on_shutdown(main.dp)
+    await main.dp.storage.close()
+    await (await main.bot.get_session()).close()
+    await api.stop()
+
+    processed = len(recorder.latencies)
+    outbound = sum(count for method, count in api.calls.items() if method not in PASSIVE_METHODS)
+    report = {
+        'listings': args.listings if not args.db else None,
+        'users': args.users,
+        'updates': processed,
+        'timeouts': harness.timeouts,
+        'seconds': round(elapsed, 3),
+        'updates_per_sec': round(processed / elapsed, 1) if elapsed else 0,
+        'latency_p50_ms': round(percentile(recorder.latencies, 0.50) * 1000, 2),
+        'latency_p99_ms': round(percentile(recorder.latencies, 0.99) * 1000, 2),
+        'latency_mean_ms': round(statistics.fmean(recorder.latencies) * 1000, 2) if processed else 0,
+        'outbound_calls': outbound,
+        'outbound_per_update': round(outbound / processed, 2) if processed else 0,
+        'outbound_by_method': dict(api.calls.most_common()),
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест бота с локальным Bot API')
+    parser.add_argument('--listings', type=int, default=10000, help='размер тестовой базы')
+    parser.add_argument('--db', default=None, help='готовая база вместо генерации')
+    parser.add_argument('--users', type=int, default=1000, help='число виртуальных пользователей')
+    parser.add_argument('--admins', type=int, default=5, help='сколько из них модерируют')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--wizard-share', type=float, default=0.3,
+                        help='доля пользователей, создающих объявление')
+    parser.add_argument('--telegram-limits', action='store_true',
+                        help='соблюдать лимиты Telegram на отправку')
+    parser.add_argument('--sql-catalog', action='store_true',
+                        help='читать каталог из базы, без модели в памяти')
+    parser.add_argument('--timeout', type=float, default=30, help='ожидание обработки обновления, с')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', default=None, help='сохранить отчёт в файл')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    for key, value in report.items():
+        print(f'{key:>22}: {value}')
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from database import connect, init_db
+
+# Распределения, похожие на реальные: большая часть объявлений одобрена,
+# категории неравномерны, фото есть примерно у трети объявлений
+STATUS_WEIGHTS = {'approved': 70, 'pending': 20, 'rejected': 10}
+CATEGORY_WEIGHTS = {'electronics': 40, 'clothing': 30, 'food': 10, 'other': 20}
+PHOTO_SHARE = 0.3
+LISTINGS_PER_USER = 5
+ADMINS = 5
+CHUNK_SIZE = 10000
+
+WORDS = (
+    'телефон', 'ноутбук', 'куртка', 'кроссовки', 'пицца', 'торт', 'наушники', 'зарядка',
+    'платье', 'джинсы', 'велосипед', 'лампа', 'чайник', 'планшет', 'часы', 'рюкзак',
+    'новый', 'б/у', 'оригинал', 'скидка', 'черный', 'белый', 'большой', 'маленький',
+)
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def _listing_rows(rng, count, users, start):
+    statuses = list(STATUS_WEIGHTS)
+    status_weights = list(STATUS_WEIGHTS.values())
+    categories = list(CATEGORY_WEIGHTS)
+    category_weights = list(CATEGORY_WEIGHTS.values())
+    for i in range(count):
+        created_at = start + timedelta(seconds=rng.randrange(365 * 24 * 3600))
+        shop_price = round(rng.uniform(100, 100000), 2)
+        status = rng.choices(statuses, status_weights)[0]
+        yield (
+            rng.randint(1, users),
+            _text(rng, 3).capitalize(),
+            _text(rng, 20),
+            f'seed-photo-{i}' if rng.random() < PHOTO_SHARE else None,
+            rng.choices(categories, category_weights)[0],
+            shop_price,
+            round(shop_price * rng.uniform(0.3, 1.0), 2),
+            rng.randint(1, 20),
+            status,
+            created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            1 if status == 'approved' else None,
+        )
+
+
+# Заполняет базу listings объявлениями и соответствующим числом пользователей.
+# Пользователи 1..ADMINS — администраторы.
+def seed_database(path, listings, seed=0):
+    init_db(path)
+    rng = random.Random(seed)
+    users = max(ADMINS + 1, listings // LISTINGS_PER_USER)
+    start = datetime.now() - timedelta(days=365)
+
+    conn = connect(path)
+    conn.execute('BEGIN')
+    conn.executemany(
+        'INSERT OR IGNORE INTO users (user_id, username, first_name, role) VALUES (?, ?, ?, ?)',
+        (
+            (user_id, f'seller{user_id}', f'Продавец {user_id}', 'admin' if user_id <= ADMINS else 'user')
+            for user_id in range(1, users + 1)
+        )
+    )
+    conn.execute('COMMIT')
+
+    rows = _listing_rows(rng, listings, users, start)
+    while True:
+        chunk = [row for _, row in zip(range(CHUNK_SIZE), rows)]
+        if not chunk:
+            break
+        conn.execute('BEGIN')
+        conn.executemany('''
+            INSERT INTO listings (user_id, title, description, photo_id, category, shop_price, my_price,
+                                  quantity, status, created_at, approved_by)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', chunk)
+        conn.execute('COMMIT')
+    conn.execute('PRAGMA optimize')
+    conn.close()
+    return users
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Заполнение базы тестовыми объявлениями')
+    parser.add_argument('path')
+    parser.add_argument('--listings', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    seed_database(args.path, args.listings, args.seed)
@@ -0,0 +1,951 @@
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import MISSING, TTLCache
+from metrics import DB_ERRORS, DB_SECONDS, timed
+from migrations import migrate, rebuild_counters
+from read_model import CatalogReadModel
+
+log = logging.getLogger(__name__)
+
+# Путь к базе данных и размер пула читающих соединений
+DB_PATH = os.getenv('DB_PATH', 'marketplace_bot.db')
+READ_POOL_SIZE = 4
+
+# Кэш ролей: роли меняются только через make_admin
+ROLE_CACHE_SIZE = 10000
+ROLE_CACHE_TTL = 300
+# Как часто сверять версию ролей: роль, изменённая другим процессом,
+# начинает действовать здесь не позже чем через столько секунд
+ROLE_SYNC_INTERVAL = 5
+
+# Настройки соединения: WAL позволяет читать параллельно с записью
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA mmap_size = 134217728',
+)
+
+
+def connect(path=DB_PATH):
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+# Пул долгоживущих соединений. Чтение идёт в нескольких потоках (у каждого
+# своё соединение), запись — в одном отдельном потоке, чтобы писатели
+# не конкурировали за блокировку базы.
+class Database:
+    def __init__(self, path=DB_PATH, read_pool_size=READ_POOL_SIZE):
+        self.path = path
+        self.read_pool_size = read_pool_size
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._reader = None
+        self._writer = None
+
+    def _init_thread(self):
+        conn = connect(self.path)
+        self._local.conn = conn
+        with self._lock:
+            self._connections.append(conn)
+
+    def _ensure_open(self):
+        if self._writer is None:
+            self._reader = ThreadPoolExecutor(self.read_pool_size, 'db-read', self._init_thread)
+            self._writer = ThreadPoolExecutor(1, 'db-write', self._init_thread)
+
+    def _run_read(self, fn, args):
+        return fn(self._local.conn, *args)
+
+    def _run_write(self, fn, args):
+        conn = self._local.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = fn(conn, *args)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return result
+
+    async def read(self, fn, *args):
+        self._ensure_open()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reader, self._run_read, fn, args)
+
+    # fn(conn, *args) выполняется целиком в одной транзакции
+    async def write(self, fn, *args):
+        self._ensure_open()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, self._run_write, fn, args)
+
+    async def fetchone(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def execute(self, sql, params=()):
+        return await self.write(lambda conn: conn.execute(sql, params).lastrowid)
+
+    def close(self):
+        for executor in (self._reader, self._writer):
+            if executor is not None:
+                executor.shutdown(wait=True)
+        self._reader = self._writer = None
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+
+db = Database()
+
+
+# Инициализация базы данных: применяет недостающие миграции
+def init_db(path=DB_PATH):
+    conn = connect(path)
+    try:
+        if not conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()[0]:
+            # Новая база: VACUUM пустой базы мгновенный
+            enable_incremental_vacuum(conn)
+        migrate(conn)
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            log.warning('auto_vacuum=INCREMENTAL выключен, место после архивации не освобождается. '
+                        'Включить (долго, база блокируется): python database.py --enable-incremental-vacuum')
+    finally:
+        conn.close()
+
+
+# Освободившиеся страницы (например, после переноса в архив) возвращаются
+# системе понемногу через PRAGMA incremental_vacuum. Для уже существующей
+# базы режим включается один раз полным VACUUM — это переписывает всю базу,
+# поэтому делается отдельной командой, а не при запуске бота.
+def enable_incremental_vacuum(conn):
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        return False
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    return True
+
+
+# Запросы горячих путей; они же проверяются через EXPLAIN QUERY PLAN
+ADMIN_IDS_SQL = "SELECT user_id FROM users WHERE role = 'admin'"
+
+ROLE_VERSION_SQL = 'SELECT version FROM role_version WHERE id = 1'
+
+PENDING_LISTINGS_SQL = '''
+    SELECT l.id, l.title, l.description, l.category, l.shop_price, l.my_price, l.quantity, u.username
+    FROM listings l
+    JOIN users u ON l.user_id = u.user_id
+    WHERE l.status = 'pending'
+    ORDER BY l.created_at
+'''
+
+APPROVED_LISTINGS_SQL = '''
+    SELECT l.id, l.title, l.description, l.photo_id, l.category, l.shop_price, l.my_price, l.quantity, u.username
+    FROM listings l
+    JOIN users u ON l.user_id = u.user_id
+    WHERE l.status = 'approved'
+    ORDER BY l.created_at DESC
+'''
+
+APPROVED_BY_CATEGORY_SQL = '''
+    SELECT l.id, l.title, l.description, l.photo_id, l.category, l.shop_price, l.my_price, l.quantity, u.username
+    FROM listings l
+    JOIN users u ON l.user_id = u.user_id
+    WHERE l.status = 'approved' AND l.category = ?
+    ORDER BY l.created_at DESC
+'''
+
+# Страницы каталога: keyset-пагинация по (столбец сортировки, id), курсор — id
+# крайнего объявления предыдущей страницы
+_PAGE_COLUMNS = '''
+    SELECT l.id, l.title, l.description, l.photo_id, l.category, l.shop_price, l.my_price, l.quantity, u.username
+    FROM listings l
+    JOIN users u ON l.user_id = u.user_id
+'''
+
+# Сортировки каталога: столбец и направление. Для каждой есть индекс
+# (status, category, столбец), id в нём — неявный последний столбец
+CATALOG_SORTS = {
+    'new': ('created_at', 'DESC'),
+    'discount': ('discount_percent', 'DESC'),
+    'cheap': ('my_price', 'ASC'),
+}
+
+
+def _catalog_page_sql(column, order):
+    backward = 'ASC' if order == 'DESC' else 'DESC'
+    after, before = ('<', '>') if order == 'DESC' else ('>', '<')
+    where = "WHERE l.status = 'approved' AND l.category = ?"
+    cursor = f'(l.{column}, l.id) {{}} (SELECT {column}, id FROM listings WHERE id = ?)'
+    return {
+        'first': _PAGE_COLUMNS + f'''
+    {where}
+    ORDER BY l.{column} {order}, l.id {order}
+    LIMIT ?
+''',
+        'next': _PAGE_COLUMNS + f'''
+    {where}
+      AND {cursor.format(after)}
+    ORDER BY l.{column} {order}, l.id {order}
+    LIMIT ?
+''',
+        'from': _PAGE_COLUMNS + f'''
+    {where}
+      AND {cursor.format(after + '=')}
+    ORDER BY l.{column} {order}, l.id {order}
+    LIMIT ?
+''',
+        'prev': _PAGE_COLUMNS + f'''
+    {where}
+      AND {cursor.format(before)}
+    ORDER BY l.{column} {backward}, l.id {backward}
+    LIMIT ?
+''',
+    }
+
+
+CATALOG_PAGE_SQL = {sort: _catalog_page_sql(*spec) for sort, spec in CATALOG_SORTS.items()}
+
+# Столбцы записи CatalogRecord
+_READ_MODEL_COLUMNS = '''
+    SELECT l.id, l.title, l.description, l.photo_id, l.category, l.shop_price, l.my_price, l.quantity, u.username,
+           l.created_at, l.discount_percent
+    FROM listings l
+    JOIN users u ON l.user_id = u.user_id
+'''
+
+CATALOG_LOAD_SQL = _READ_MODEL_COLUMNS + "WHERE l.status = 'approved'"
+
+# Сверка модели с базой: число одобренных и сумма их id
+CATALOG_CHECKSUM_SQL = "SELECT COUNT(*), COALESCE(SUM(id), 0) FROM listings WHERE status = 'approved'"
+
+# Все одобренные объявления постранично (для inline-режима)
+APPROVED_FIRST_PAGE_SQL = _PAGE_COLUMNS + '''
+    WHERE l.status = 'approved'
+    ORDER BY l.created_at DESC, l.id DESC
+    LIMIT ?
+'''
+
+APPROVED_NEXT_PAGE_SQL = _PAGE_COLUMNS + '''
+    WHERE l.status = 'approved'
+      AND (l.created_at, l.id) < (SELECT created_at, id FROM listings WHERE id = ?)
+    ORDER BY l.created_at DESC, l.id DESC
+    LIMIT ?
+'''
+
+# Выгрузка объявлений; строки читаются курсором, без загрузки всего результата
+EXPORT_COLUMNS = (
+    'id', 'title', 'description', 'category', 'shop_price', 'my_price',
+    'quantity', 'status', 'photo_id', 'created_at',
+)
+
+USER_EXPORT_SQL = f'''
+    SELECT {', '.join(EXPORT_COLUMNS)}
+    FROM listings
+    WHERE user_id = ?
+    ORDER BY created_at, id
+'''
+
+APPROVED_EXPORT_SQL = f'''
+    SELECT {', '.join(EXPORT_COLUMNS)}
+    FROM listings
+    WHERE status = 'approved'
+    ORDER BY created_at, id
+'''
+
+# Очередь модерации постранично, от старых к новым
+_PENDING_COLUMNS = '''
+    SELECT l.id, l.title, l.description, l.category, l.shop_price, l.my_price, l.quantity, u.username
+    FROM listings l
+    JOIN users u ON l.user_id = u.user_id
+'''
+
+PENDING_FIRST_PAGE_SQL = _PENDING_COLUMNS + '''
+    WHERE l.status = 'pending'
+    ORDER BY l.created_at, l.id
+    LIMIT ?
+'''
+
+PENDING_NEXT_PAGE_SQL = _PENDING_COLUMNS + '''
+    WHERE l.status = 'pending'
+      AND (l.created_at, l.id) > (SELECT created_at, id FROM listings WHERE id = ?)
+    ORDER BY l.created_at, l.id
+    LIMIT ?
+'''
+
+PENDING_FROM_PAGE_SQL = _PENDING_COLUMNS + '''
+    WHERE l.status = 'pending'
+      AND (l.created_at, l.id) >= (SELECT created_at, id FROM listings WHERE id = ?)
+    ORDER BY l.created_at, l.id
+    LIMIT ?
+'''
+
+USER_LISTINGS_SQL = '''
+    SELECT id, title, category, shop_price, my_price, quantity, status, created_at
+    FROM listings
+    WHERE user_id = ?
+    ORDER BY created_at DESC
+'''
+
+# Кандидаты в архив: отклонённые и давно опубликованные объявления старше
+# ?1 (модификатор для datetime, например '-7 days'). Дата отклонения или
+# публикации не раньше даты создания, поэтому created_at отсекает лишнее по индексу
+ARCHIVE_CANDIDATES_SQL = {
+    'rejected': '''
+        SELECT id FROM listings
+        WHERE status = 'rejected' AND created_at < datetime('now', ?1)
+          AND COALESCE(rejected_at, created_at) < datetime('now', ?1)
+        LIMIT ?2
+    ''',
+    'expired': '''
+        SELECT id FROM listings
+        WHERE status = 'approved' AND created_at < datetime('now', ?1)
+          AND COALESCE(approved_at, created_at) < datetime('now', ?1)
+        LIMIT ?2
+    ''',
+}
+
+_ARCHIVE_COLUMNS = (
+    'id, user_id, title, description, photo_id, category, shop_price, my_price, quantity, '
+    'status, created_at, approved_at, approved_by, rejected_at'
+)
+
+# Следующая пачка подписчиков категории после user_id = ?2
+SUBSCRIBERS_CHUNK_SQL = '''
+    SELECT user_id FROM subscriptions
+    WHERE category = ?1 AND user_id > ?2
+    ORDER BY user_id
+    LIMIT ?3
+'''
+
+# Самое старое задание рассылки и его объявление (NULL, если объявление
+# уже удалено или перенесено в архив)
+FANOUT_NEXT_JOB_SQL = '''
+    SELECT j.id, j.cursor, l.id, l.user_id, l.title, l.category, l.shop_price, l.my_price, l.quantity, l.status
+    FROM fanout_jobs j
+    LEFT JOIN listings l ON l.id = j.listing_id
+    ORDER BY j.id
+    LIMIT 1
+'''
+
+USER_ARCHIVE_SQL = '''
+    SELECT id, title, category, shop_price, my_price, quantity, status, created_at, archived_at, archive_reason
+    FROM listings_archive
+    WHERE user_id = ?
+    ORDER BY archived_at DESC
+    LIMIT ?
+'''
+
+# Берёт до limit уведомлений, которые пора отправить, и помечает их
+# отправляемыми на lease секунд. Если отправитель упадёт, после этого срока
+# уведомление возьмёт кто-то другой. Несколько процессов не возьмут одно и то же.
+OUTBOX_DUE_SQL = '''
+    SELECT id FROM outbox INDEXED BY idx_outbox_due
+    WHERE status IN ('pending', 'sending') AND next_attempt_at <= ?
+    ORDER BY next_attempt_at
+    LIMIT ?
+'''
+
+OUTBOX_CLAIM_SQL = f'''
+    UPDATE outbox
+    SET status = 'sending', next_attempt_at = ?
+    WHERE id IN ({OUTBOX_DUE_SQL})
+    RETURNING id, chat_id, text, parse_mode, attempts
+'''
+
+HOT_QUERIES = {
+    'enqueue_admin_notification': (ADMIN_IDS_SQL, ()),
+    'sync_roles': (ROLE_VERSION_SQL, ()),
+    'get_pending_listings': (PENDING_LISTINGS_SQL, ()),
+    'get_approved_listings': (APPROVED_LISTINGS_SQL, ()),
+    'get_approved_listings(category)': (APPROVED_BY_CATEGORY_SQL, ('food',)),
+    'get_user_listings': (USER_LISTINGS_SQL, (0,)),
+    **{
+        f'get_catalog_page({sort}, {direction})': (sql, ('food', 6) if direction == 'first' else ('food', 0, 6))
+        for sort, queries in CATALOG_PAGE_SQL.items()
+        for direction, sql in queries.items()
+    },
+    'get_approved_listings(limit)': (APPROVED_FIRST_PAGE_SQL, (6,)),
+    'get_approved_listings(limit, after_id)': (APPROVED_NEXT_PAGE_SQL, (0, 6)),
+    'load_catalog': (CATALOG_LOAD_SQL, ()),
+    'sync_catalog': (CATALOG_CHECKSUM_SQL, ()),
+    'export_listings(user)': (USER_EXPORT_SQL, (0,)),
+    'export_listings(approved)': (APPROVED_EXPORT_SQL, ()),
+    'claim_notifications': (OUTBOX_DUE_SQL, (0, 50)),
+    'archive_listings(rejected)': (ARCHIVE_CANDIDATES_SQL['rejected'], ('-7 days', 500)),
+    'archive_listings(expired)': (ARCHIVE_CANDIDATES_SQL['expired'], ('-90 days', 500)),
+    'get_user_archive': (USER_ARCHIVE_SQL, (0, 21)),
+    'fanout_chunk(subscribers)': (SUBSCRIBERS_CHUNK_SQL, ('food', 0, 500)),
+    'get_user_subscriptions': ('SELECT category FROM subscriptions WHERE user_id = ?', (0,)),
+    'purge_notifications': ("SELECT id FROM outbox WHERE status = 'done' AND created_at < ?", ('',)),
+    'get_moderation_page(first)': (PENDING_FIRST_PAGE_SQL, (11,)),
+    'get_moderation_page(next)': (PENDING_NEXT_PAGE_SQL, (0, 11)),
+    'get_moderation_page(from)': (PENDING_FROM_PAGE_SQL, (0, 11)),
+    'count_admins': ("SELECT COUNT(*) FROM users WHERE role = 'admin'", ()),
+    'count_listings_by_status': ("SELECT COUNT(*) FROM listings WHERE status = 'pending'", ()),
+}
+
+
+# Возвращает {имя запроса: (план, использует ли индекс)}.
+# Запрос считается плохим, если он сканирует таблицу без индекса
+# или сортирует результат во временном B-дереве.
+def check_query_plans(conn):
+    report = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+        details = [row[-1] for row in rows]
+        ok = not any(
+            (detail.startswith('SCAN') and 'INDEX' not in detail) or 'TEMP B-TREE' in detail
+            for detail in details
+        )
+        report[name] = (details, ok)
+    return report
+
+
+role_cache = TTLCache(ROLE_CACHE_SIZE, ROLE_CACHE_TTL)
+# Идущие чтения роли: user_id -> метка. Сброс роли убирает метку, и
+# прочитанное до сброса значение в кэш уже не попадает
+_role_reads = {}
+# Версия ролей, с которой согласован кэш; None — ещё не сверялись
+_role_version = None
+
+# Одобренные объявления в памяти: после load_catalog каталог читается
+# отсюда, а moderate_listings и archive_listings обновляют модель сами
+catalog = CatalogReadModel(CATALOG_SORTS)
+
+# Время и ошибки каждой функции попадают в метрики bot_db_*
+timed_query = timed(DB_SECONDS, DB_ERRORS)
+
+
+# Функции для работы с базой данных
+@timed_query
+async def get_user_role(user_id):
+    role = role_cache.get(user_id)
+    if role is not MISSING:
+        return role
+    token = _role_reads[user_id] = object()
+    try:
+        result = await db.fetchone('SELECT role FROM users WHERE user_id = ?', (user_id,))
+    finally:
+        current = _role_reads.get(user_id)
+        if current is token:
+            del _role_reads[user_id]
+    role = result[0] if result else None
+    if current is token:
+        role_cache.set(user_id, role)
+    return role
+
+
+def invalidate_role(user_id):
+    role_cache.invalidate(user_id)
+    _role_reads.pop(user_id, None)
+
+
+# Сверяет версию ролей с базой: make_admin в другом процессе сбрасывает
+# только свой кэш, здесь он сбрасывается целиком при смене версии
+@timed_query
+async def sync_roles():
+    global _role_version
+    version = (await db.fetchone(ROLE_VERSION_SQL))[0]
+    if version == _role_version:
+        return False
+    role_cache.clear()
+    _role_reads.clear()
+    _role_version = version
+    return True
+
+
+@timed_query
+async def add_user(user_id, username, first_name):
+    inserted = await db.write(lambda conn: conn.execute('''
+        INSERT OR IGNORE INTO users (user_id, username, first_name)
+        VALUES (?, ?, ?)
+    ''', (user_id, username, first_name)).rowcount)
+    # Роль меняется, только если пользователя ещё не было (в кэше мог остаться None)
+    if inserted == 1:
+        invalidate_role(user_id)
+
+
+@timed_query
+async def make_admin(user_id):
+    await db.execute('UPDATE users SET role = ? WHERE user_id = ?', ('admin', user_id))
+    invalidate_role(user_id)
+
+
+# Очередь уведомлений (таблица outbox). Строки добавляются в транзакции
+# вызывающей функции, отправляет их фоновая задача из outbox.py.
+# rows — кортежи (chat_id, text, parse_mode)
+def enqueue_notifications(conn, rows):
+    now = time.time()
+    conn.executemany(
+        'INSERT INTO outbox (chat_id, text, parse_mode, next_attempt_at) VALUES (?, ?, ?, ?)',
+        [(chat_id, text, parse_mode, now) for chat_id, text, parse_mode in rows]
+    )
+
+
+def enqueue_admin_notification(conn, text, parse_mode='HTML'):
+    conn.execute(f'''
+        INSERT INTO outbox (chat_id, text, parse_mode, next_attempt_at)
+        SELECT user_id, ?, ?, ? FROM ({ADMIN_IDS_SQL})
+    ''', (text, parse_mode, time.time()))
+
+
+def _add_listing(conn, row, admin_notice):
+    listing_id = conn.execute('''
+        INSERT INTO listings (user_id, title, description, photo_id, category, shop_price, my_price, quantity)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', row).lastrowid
+    if admin_notice is not None:
+        enqueue_admin_notification(conn, admin_notice(listing_id))
+    return listing_id
+
+
+# admin_notice(listing_id) — текст уведомления администраторам (HTML);
+# оно ставится в очередь той же транзакцией, что и объявление
+@timed_query
+async def add_listing(user_id, title, description, photo_id, category, shop_price, my_price, quantity,
+                      admin_notice=None):
+    row = (user_id, title, description, photo_id, category, shop_price, my_price, quantity)
+    return await db.write(_add_listing, row, admin_notice)
+
+
+@timed_query
+async def notify_admins(text, parse_mode='HTML'):
+    await db.write(enqueue_admin_notification, text, parse_mode)
+
+
+# rows — кортежи (user_id, title, description, photo_id, category, shop_price,
+# my_price, quantity); все вставляются одной транзакцией
+@timed_query
+async def add_listings(rows):
+    return await db.write(lambda conn: conn.executemany('''
+        INSERT INTO listings (user_id, title, description, photo_id, category, shop_price, my_price, quantity)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows).rowcount)
+
+
+@timed_query
+async def get_pending_listings():
+    return await db.fetchall(PENDING_LISTINGS_SQL)
+
+
+# С limit возвращает не больше limit объявлений, начиная после after_id
+@timed_query
+async def get_approved_listings(category=None, limit=None, after_id=None):
+    if catalog.loaded:
+        if limit is None:
+            return catalog.rows(category)
+        listings, _, _ = catalog.page(category, limit, 'next' if after_id else 'first', after_id)
+        return listings
+    if limit is not None:
+        if category:
+            listings, _, _ = await get_catalog_page(category, limit, 'next' if after_id else 'first', after_id)
+            return listings
+        if after_id:
+            return await db.fetchall(APPROVED_NEXT_PAGE_SQL, (after_id, limit))
+        return await db.fetchall(APPROVED_FIRST_PAGE_SQL, (limit,))
+    if category:
+        return await db.fetchall(APPROVED_BY_CATEGORY_SQL, (category,))
+    return await db.fetchall(APPROVED_LISTINGS_SQL)
+
+
+# Возвращает (объявления, есть_предыдущая, есть_следующая).
+# direction: 'first', 'next' (после cursor_id), 'from' (начиная с cursor_id)
+# или 'prev' (перед cursor_id); sort — ключ CATALOG_SORTS
+@timed_query
+async def get_catalog_page(category, page_size, direction='first', cursor_id=None, sort='new'):
+    if catalog.loaded:
+        return catalog.page(category, page_size, direction, cursor_id, sort)
+    return await db.read(_catalog_page, category, page_size, direction, cursor_id, sort)
+
+
+def _catalog_page(conn, category, page_size, direction, cursor_id, sort):
+    queries = CATALOG_PAGE_SQL[sort]
+    if direction != 'first':
+        rows = conn.execute(queries[direction], (category, cursor_id, page_size + 1)).fetchall()
+        # Пусто, если объявления-курсора больше нет (ушло в архив) или за ним
+        # ничего не осталось — показываем первую страницу
+        if rows and direction == 'prev':
+            return list(reversed(rows[:page_size])), len(rows) > page_size, True
+        if rows:
+            return rows[:page_size], True, len(rows) > page_size
+    rows = conn.execute(queries['first'], (category, page_size + 1)).fetchall()
+    return rows[:page_size], False, len(rows) > page_size
+
+
+# Сравнивает страницы каталога из модели в памяти и из базы для курсоров в
+# начале, середине и конце каждой категории, а также для удалённого курсора.
+# Возвращает расхождения: (сортировка, категория, направление, курсор)
+def check_catalog_model(conn, page_size=5):
+    model = CatalogReadModel(CATALOG_SORTS)
+    model.load(conn.execute(CATALOG_LOAD_SQL))
+    missing_id = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM listings').fetchone()[0]
+    categories = [row[0] for row in conn.execute(
+        "SELECT DISTINCT category FROM listings WHERE status = 'approved'")]
+    mismatches = []
+    for sort in CATALOG_SORTS:
+        for category in categories:
+            ids = [row[0] for row in model.page(category, len(model), 'first', None, sort)[0]]
+            positions = {0, 1, page_size - 1, page_size, len(ids) // 2, len(ids) - 2, len(ids) - 1}
+            cursors = [ids[i] for i in sorted(positions) if 0 <= i < len(ids)] + [missing_id]
+            for cursor_id in [None] + cursors:
+                for direction in ('first',) if cursor_id is None else ('next', 'from', 'prev'):
+                    rows, has_prev, has_next = _catalog_page(conn, category, page_size, direction, cursor_id, sort)
+                    model_rows, model_prev, model_next = model.page(category, page_size, direction, cursor_id, sort)
+                    # Описание в модели укорочено, поэтому сравниваются id
+                    if ([row[0] for row in rows], has_prev, has_next) != \
+                            ([row[0] for row in model_rows], model_prev, model_next):
+                        mismatches.append((sort, category, direction, cursor_id))
+    return mismatches
+
+
+# Загружает одобренные объявления в модель; записи строятся в потоке чтения
+@timed_query
+async def load_catalog():
+    await db.read(lambda conn: catalog.load(conn.execute(CATALOG_LOAD_SQL)))
+
+
+# Перечитывает объявления listing_ids в модель: одобренные добавляются, остальные удаляются
+@timed_query
+async def refresh_catalog(listing_ids):
+    if not catalog.loaded:
+        return
+    placeholders = ', '.join('?' * len(listing_ids))
+    rows = await db.fetchall(
+        _READ_MODEL_COLUMNS + f"WHERE l.status = 'approved' AND l.id IN ({placeholders})", listing_ids
+    )
+    for listing_id in listing_ids:
+        catalog.remove(listing_id)
+    for row in rows:
+        catalog.add(row)
+
+
+# Сверяет модель с базой и перезагружает её при расхождении (например,
+# объявление одобрили в другом процессе). Возвращает, была ли перезагрузка
+@timed_query
+async def sync_catalog():
+    if not catalog.loaded:
+        return False
+    count, checksum = await db.fetchone(CATALOG_CHECKSUM_SQL)
+    if (count, checksum) == (len(catalog), catalog.checksum):
+        return False
+    await load_catalog()
+    return True
+
+
+# Полнотекстовый поиск по одобренным объявлениям (FTS5, ранжирование bm25)
+SEARCH_LISTINGS_SQL = '''
+    SELECT l.id, l.title, l.description, l.photo_id, l.category, l.shop_price, l.my_price, l.quantity, u.username
+    FROM listings_fts
+    JOIN listings l ON l.id = listings_fts.rowid
+    JOIN users u ON l.user_id = u.user_id
+    WHERE listings_fts MATCH ? AND (? IS NULL OR listings_fts.category = ?)
+    ORDER BY listings_fts.rank, l.id DESC
+    LIMIT ? OFFSET ?
+'''
+
+SEARCH_MAX_TERMS = 10
+
+
+# Превращает пользовательский ввод в безопасный запрос FTS5:
+# каждое слово ищется как префикс, все слова должны встретиться
+def build_match_query(text):
+    terms = re.findall(r'\w+', text.lower())[:SEARCH_MAX_TERMS]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+# Возвращает (объявления, есть_следующая_страница)
+@timed_query
+async def search_listings(text, page_size, page=1, category=None):
+    match = build_match_query(text)
+    if not match:
+        return [], False
+    rows = await db.fetchall(
+        SEARCH_LISTINGS_SQL,
+        (match, category, category, page_size + 1, (page - 1) * page_size)
+    )
+    return rows[:page_size], len(rows) > page_size
+
+
+# Возвращает (объявления, есть_следующая). direction: 'first', 'next'
+# (после cursor_id) или 'from' (начиная с cursor_id)
+@timed_query
+async def get_moderation_page(page_size, direction='first', cursor_id=None):
+    if direction == 'next':
+        rows = await db.fetchall(PENDING_NEXT_PAGE_SQL, (cursor_id, page_size + 1))
+    elif direction == 'from':
+        rows = await db.fetchall(PENDING_FROM_PAGE_SQL, (cursor_id, page_size + 1))
+    else:
+        rows = await db.fetchall(PENDING_FIRST_PAGE_SQL, (page_size + 1,))
+    return rows[:page_size], len(rows) > page_size
+
+
+def _moderate(conn, listing_ids, status, admin_id, author_notices):
+    placeholders = ', '.join('?' * len(listing_ids))
+    moderated = conn.execute(
+        f"SELECT id, user_id, title FROM listings WHERE status = 'pending' AND id IN ({placeholders})",
+        listing_ids
+    ).fetchall()
+    if status == 'approved':
+        conn.executemany('''
+            UPDATE listings
+            SET status = 'approved', approved_at = CURRENT_TIMESTAMP, approved_by = ?
+            WHERE id = ?
+        ''', [(admin_id, row[0]) for row in moderated])
+        # Подписчиков категории уведомит фоновая рассылка (fanout.py)
+        conn.executemany('INSERT INTO fanout_jobs (listing_id) VALUES (?)', [(row[0],) for row in moderated])
+    else:
+        conn.executemany(
+            'UPDATE listings SET status = ?, rejected_at = CURRENT_TIMESTAMP WHERE id = ?',
+            [(status, row[0]) for row in moderated]
+        )
+    if author_notices is not None and moderated:
+        enqueue_notifications(conn, author_notices(moderated))
+    return moderated
+
+
+# Одобряет или отклоняет сразу несколько объявлений одной транзакцией.
+# Уже обработанные пропускаются; возвращает (id, user_id, title) изменённых.
+# author_notices(изменённые) возвращает уведомления (chat_id, text, parse_mode),
+# которые ставятся в очередь той же транзакцией
+@timed_query
+async def moderate_listings(listing_ids, status, admin_id=None, author_notices=None):
+    listing_ids = list(listing_ids)
+    if not listing_ids:
+        return []
+    moderated = await db.write(_moderate, listing_ids, status, admin_id, author_notices)
+    if status == 'approved' and moderated:
+        await refresh_catalog([row[0] for row in moderated])
+    return moderated
+
+
+async def approve_listing(listing_id, admin_id):
+    return await moderate_listings([listing_id], 'approved', admin_id)
+
+
+async def reject_listing(listing_id):
+    return await moderate_listings([listing_id], 'rejected')
+
+
+@timed_query
+async def get_listing_by_id(listing_id):
+    return await db.fetchone('''
+        SELECT l.id, l.user_id, l.title, l.description, l.photo_id, l.category, l.shop_price, l.my_price,
+               l.quantity, l.status, l.created_at, u.username, u.first_name
+        FROM listings l
+        JOIN users u ON l.user_id = u.user_id
+        WHERE l.id = ?
+    ''', (listing_id,))
+
+
+# consumer(cursor) выполняется в потоке чтения и сам перебирает строки
+# (столбцы EXPORT_COLUMNS); без user_id — весь одобренный каталог
+@timed_query
+async def export_listings(consumer, user_id=None):
+    if user_id is not None:
+        return await db.read(lambda conn: consumer(conn.execute(USER_EXPORT_SQL, (user_id,))))
+    return await db.read(lambda conn: consumer(conn.execute(APPROVED_EXPORT_SQL)))
+
+
+@timed_query
+async def get_user_listings(user_id):
+    return await db.fetchall(USER_LISTINGS_SQL, (user_id,))
+
+
+@timed_query
+async def get_user_archive(user_id, limit):
+    return await db.fetchall(USER_ARCHIVE_SQL, (user_id, limit))
+
+
+def _archive_batch(conn, reason, max_age, limit):
+    ids = [row[0] for row in conn.execute(ARCHIVE_CANDIDATES_SQL[reason], (max_age, limit))]
+    if ids:
+        placeholders = ', '.join('?' * len(ids))
+        conn.execute(f'''
+            INSERT INTO listings_archive ({_ARCHIVE_COLUMNS}, archive_reason)
+            SELECT {_ARCHIVE_COLUMNS}, ? FROM listings WHERE id IN ({placeholders})
+        ''', [reason] + ids)
+        conn.execute(f'DELETE FROM listings WHERE id IN ({placeholders})', ids)
+    return ids
+
+
+# Переносит в архив до limit объявлений одной транзакцией.
+# reason: 'rejected' или 'expired'; max_age — модификатор datetime, например '-7 days'.
+# Возвращает id перенесённых
+@timed_query
+async def archive_listings(reason, max_age, limit):
+    ids = await db.write(_archive_batch, reason, max_age, limit)
+    for listing_id in ids:
+        catalog.remove(listing_id)
+    return ids
+
+
+# Возвращает системе до pages свободных страниц и обновляет статистику планировщика
+def _compact(conn, pages):
+    conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+    conn.execute('PRAGMA optimize')
+
+
+@timed_query
+async def compact_database(pages):
+    await db.write(_compact, pages)
+
+
+@timed_query
+async def get_user_subscriptions(user_id):
+    rows = await db.fetchall('SELECT category FROM subscriptions WHERE user_id = ?', (user_id,))
+    return {row[0] for row in rows}
+
+
+@timed_query
+async def set_subscription(user_id, category, subscribed):
+    if subscribed:
+        sql = 'INSERT OR IGNORE INTO subscriptions (category, user_id) VALUES (?, ?)'
+    else:
+        sql = 'DELETE FROM subscriptions WHERE category = ? AND user_id = ?'
+    await db.write(lambda conn: conn.execute(sql, (category, user_id)))
+
+
+def _fanout_chunk(conn, chunk_size, render):
+    job = conn.execute(FANOUT_NEXT_JOB_SQL).fetchone()
+    if job is None:
+        return None
+    job_id, cursor, listing = job[0], job[1], job[2:]
+    # Объявление успели снять или перенести в архив — рассылать нечего
+    if listing[0] is None or listing[-1] != 'approved':
+        conn.execute('DELETE FROM fanout_jobs WHERE id = ?', (job_id,))
+        return 0
+    subscribers = [row[0] for row in conn.execute(SUBSCRIBERS_CHUNK_SQL, (listing[3], cursor, chunk_size))]
+    text, parse_mode = render(listing[:-1])
+    enqueue_notifications(conn, [
+        (user_id, text, parse_mode) for user_id in subscribers if user_id != listing[1]
+    ])
+    if len(subscribers) < chunk_size:
+        conn.execute('DELETE FROM fanout_jobs WHERE id = ?', (job_id,))
+    else:
+        conn.execute('UPDATE fanout_jobs SET cursor = ? WHERE id = ?', (subscribers[-1], job_id))
+    return len(subscribers)
+
+
+# Ставит в outbox уведомления для следующей пачки подписчиков самого старого
+# задания рассылки и сдвигает его курсор — всё одной транзакцией, поэтому
+# после перезапуска рассылка продолжается с того же места.
+# render(id, user_id, title, category, shop_price, my_price, quantity) возвращает
+# (text, parse_mode). Возвращает размер пачки или None, если заданий нет
+@timed_query
+async def fanout_chunk(chunk_size, render):
+    return await db.write(_fanout_chunk, chunk_size, render)
+
+
+# Статистика для админ панели: читается из счётчиков, которые триггеры
+# обновляют в той же транзакции, что и сами изменения
+@timed_query
+async def get_statistics():
+    rows = await db.fetchall('SELECT key, value FROM stats_counters')
+    counters = dict(rows)
+    category_stats = [
+        (key.split(':', 1)[1], value)
+        for key, value in rows
+        if key.startswith('approved:') and value > 0
+    ]
+    return {
+        'total_users': counters.get('users', 0),
+        'total_admins': counters.get('role:admin', 0),
+        'total_listings': counters.get('listings', 0),
+        'pending_listings': counters.get('status:pending', 0),
+        'approved_listings': counters.get('status:approved', 0),
+        'rejected_listings': counters.get('status:rejected', 0),
+        'archived_listings': counters.get('archived', 0),
+        'category_stats': category_stats,
+    }
+
+
+@timed_query
+async def claim_notifications(limit, lease):
+    now = time.time()
+    return await db.write(lambda conn: conn.execute(OUTBOX_CLAIM_SQL, (now + lease, now, limit)).fetchall())
+
+
+# done — id доставленных; retry — (id, время следующей попытки, ошибка);
+# failed — (id, ошибка). Всё записывается одной транзакцией
+def _finish_notifications(conn, done, retry, failed):
+    conn.executemany("UPDATE outbox SET status = 'done', attempts = attempts + 1 WHERE id = ?",
+                     [(outbox_id,) for outbox_id in done])
+    conn.executemany('''
+        UPDATE outbox SET status = 'pending', attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+        WHERE id = ?
+    ''', [(next_attempt_at, error, outbox_id) for outbox_id, next_attempt_at, error in retry])
+    conn.executemany("UPDATE outbox SET status = 'failed', attempts = attempts + 1, last_error = ? WHERE id = ?",
+                     [(error, outbox_id) for outbox_id, error in failed])
+
+
+@timed_query
+async def finish_notifications(done=(), retry=(), failed=()):
+    await db.write(_finish_notifications, list(done), list(retry), list(failed))
+
+
+# Удаляет доставленные уведомления старше older_than секунд
+@timed_query
+async def purge_notifications(older_than):
+    return await db.write(lambda conn: conn.execute(
+        "DELETE FROM outbox WHERE status = 'done' AND created_at < datetime('now', ?)",
+        (f'-{int(older_than)} seconds',)
+    ).rowcount)
+
+
+if __name__ == '__main__':
+    import sys
+
+    init_db()
+    conn = connect()
+
+    # python database.py --rebuild-counters — пересчитать статистику
+    if '--rebuild-counters' in sys.argv:
+        conn.execute('BEGIN IMMEDIATE')
+        rebuild_counters(conn)
+        conn.execute('COMMIT')
+        conn.close()
+        print('Счётчики статистики пересчитаны')
+        sys.exit(0)
+
+    # python database.py --enable-incremental-vacuum — один раз для старой базы, бот лучше остановить
+    if '--enable-incremental-vacuum' in sys.argv:
+        enabled = enable_incremental_vacuum(conn)
+        conn.close()
+        print('auto_vacuum=INCREMENTAL включён' if enabled else 'auto_vacuum=INCREMENTAL уже включён')
+        sys.exit(0)
+
+    # python database.py --check-catalog — сравнить модель каталога с запросами к базе
+    if '--check-catalog' in sys.argv:
+        mismatches = check_catalog_model(conn)
+        conn.close()
+        for mismatch in mismatches:
+            print('BAD', *mismatch)
+        print(f'Расхождений модели каталога с базой: {len(mismatches)}')
+        sys.exit(1 if mismatches else 0)
+
+    # python database.py — проверить планы горячих запросов
+    failed = False
+    for name, (details, ok) in check_query_plans(conn).items():
+        print(f"{'OK ' if ok else 'BAD'} {name}")
+        for detail in details:
+            print(f'      {detail}')
+        failed = failed or not ok
+    conn.close()
+    sys.exit(1 if failed else 0)
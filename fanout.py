@@ -0,0 +1,39 @@
+from background import BackgroundJob
+from database import fanout_chunk
+from metrics import Counter
+
+# Рассылка подписчикам категории о новом объявлении. Одобрение только создаёт
+# задание; эта задача читает подписчиков пачками и ставит уведомления в
+# outbox, откуда их отправляет OutboxSender. В памяти — не больше одной пачки.
+CHUNK_SIZE = 500
+# Сообщений в секунду. Ниже общего лимита бота, чтобы в outbox оставалось
+# место для остальных уведомлений
+FANOUT_RATE = 20
+POLL_INTERVAL = 5
+
+PROCESSED = Counter('bot_fanout_subscribers_total', 'Подписчики, обработанные рассылкой')
+
+
+# wake() — есть новое задание, не ждать poll_interval
+class FanoutJob(BackgroundJob):
+    failure_message = 'Не удалось выполнить рассылку подписчикам'
+
+    def __init__(self, render, on_enqueue=None, chunk_size=CHUNK_SIZE, rate=FANOUT_RATE,
+                 poll_interval=POLL_INTERVAL):
+        super().__init__(poll_interval)
+        self.render = render
+        self.on_enqueue = on_enqueue
+        self.chunk_size = chunk_size
+        self.rate = rate
+
+    async def step(self):
+        count = await fanout_chunk(self.chunk_size, self.render)
+        if count is None:
+            return None
+        if count:
+            PROCESSED.inc(amount=count)
+            if self.on_enqueue is not None:
+                self.on_enqueue()
+        # Следующая пачка — когда outbox успеет отправить эту;
+        # новые задания темп не ускоряют
+        return count / self.rate
@@ -0,0 +1,243 @@
+import asyncio
+import copy
+import json
+import logging
+import time
+import typing
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from database import Database
+
+log = logging.getLogger(__name__)
+
+FSM_STORAGE_PATH = 'fsm_storage.db'
+# Как часто сбрасывать накопленные изменения в базу
+FLUSH_INTERVAL = 0.05
+# Через сколько секунд бездействия незаконченный сценарий удаляется
+SESSION_TTL = 24 * 60 * 60
+CLEANUP_INTERVAL = 10 * 60
+
+_EMPTY = {'state': None, 'data': {}, 'bucket': {}}
+
+
+# Хранилище состояний FSM в отдельном файле SQLite. Переживает перезапуск
+# и может использоваться несколькими процессами бота одновременно.
+#
+# Изменения копятся в памяти и раз в FLUSH_INTERVAL записываются одной
+# транзакцией, поэтому несколько update_data/set_state подряд дают одну
+# запись в базу. Пока изменение не записано, этот процесс читает его из
+# памяти; остальные процессы увидят его не позже чем через FLUSH_INTERVAL.
+class SQLiteStorage(BaseStorage):
+    def __init__(self, path=FSM_STORAGE_PATH, flush_interval=FLUSH_INTERVAL,
+                 session_ttl=SESSION_TTL, cleanup_interval=CLEANUP_INTERVAL):
+        self._db = Database(path, read_pool_size=2)
+        self.flush_interval = flush_interval
+        self.session_ttl = session_ttl
+        self.cleanup_interval = cleanup_interval
+        self._pending = {}
+        self._flushing = {}
+        # Сколько раз изменения передавались на запись; по нему _modify
+        # узнаёт, что запись ушла в базу, пока шло чтение
+        self._flushes = 0
+        self._tasks = []
+        self._started = None
+
+    async def _ensure_started(self):
+        if self._started is None:
+            self._started = asyncio.ensure_future(self._start())
+        await self._started
+
+    async def _start(self):
+        await self._db.write(_create_schema)
+        self._tasks = [
+            asyncio.ensure_future(self._flush_loop()),
+            asyncio.ensure_future(self._cleanup_loop()),
+        ]
+
+    def _key(self, chat, user):
+        chat, user = self.check_address(chat=chat, user=user)
+        return str(chat), str(user)
+
+    # Текущая запись: сначала из ещё не записанных изменений, затем из базы
+    async def _read(self, key):
+        await self._ensure_started()
+        record = self._pending.get(key) or self._flushing.get(key)
+        if record is not None:
+            return record
+        row = await self._db.fetchone(
+            'SELECT state, data, bucket FROM fsm_state WHERE chat = ? AND user = ?', key
+        )
+        if row is None:
+            return _EMPTY
+        return {'state': row[0], 'data': json.loads(row[1]), 'bucket': json.loads(row[2])}
+
+    # Запись для изменения; она попадёт в базу при следующем сбросе
+    async def _modify(self, key):
+        while True:
+            record = self._pending.get(key)
+            if record is not None:
+                return record
+            flushes = self._flushes
+            loaded = copy.deepcopy(await self._read(key))
+            # Пока шло чтение, запись могла измениться в другой корутине или
+            # уйти в базу при сбросе — тогда прочитанное устарело, читаем заново
+            if key not in self._pending and flushes == self._flushes:
+                self._pending[key] = loaded
+                return loaded
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        record = await self._read(self._key(chat, user))
+        return record['state'] if record['state'] is not None else self.resolve_state(default)
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None) -> typing.Dict:
+        record = await self._read(self._key(chat, user))
+        return copy.deepcopy(record['data'] or default or {})
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        record = await self._modify(self._key(chat, user))
+        record['state'] = self.resolve_state(state)
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        record = await self._modify(self._key(chat, user))
+        record['data'] = copy.deepcopy(data or {})
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None, **kwargs):
+        record = await self._modify(self._key(chat, user))
+        record['data'].update(copy.deepcopy(data or {}), **kwargs)
+
+    async def reset_state(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          with_data: typing.Optional[bool] = True):
+        record = await self._modify(self._key(chat, user))
+        record['state'] = None
+        if with_data:
+            record['data'] = {}
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         default: typing.Optional[dict] = None) -> typing.Dict:
+        record = await self._read(self._key(chat, user))
+        return copy.deepcopy(record['bucket'] or default or {})
+
+    async def set_bucket(self, *,
+                         chat: typing.Union[str, int, None] = None,
+                         user: typing.Union[str, int, None] = None,
+                         bucket: typing.Dict = None):
+        record = await self._modify(self._key(chat, user))
+        record['bucket'] = copy.deepcopy(bucket or {})
+
+    async def update_bucket(self, *,
+                            chat: typing.Union[str, int, None] = None,
+                            user: typing.Union[str, int, None] = None,
+                            bucket: typing.Dict = None, **kwargs):
+        record = await self._modify(self._key(chat, user))
+        record['bucket'].update(copy.deepcopy(bucket or {}), **kwargs)
+
+    # Записывает все накопленные изменения одной транзакцией
+    async def flush(self):
+        if not self._pending or self._flushing:
+            return
+        self._flushing, self._pending = self._pending, {}
+        self._flushes += 1
+        try:
+            await self._db.write(_write_records, self._flushing, time.time())
+        except Exception:
+            # Не теряем изменения: вернём их в очередь, если их не перезаписали
+            for key, record in self._flushing.items():
+                self._pending.setdefault(key, record)
+            raise
+        finally:
+            self._flushing = {}
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception('Не удалось сохранить состояния FSM')
+
+    # Удаляет сценарии, брошенные на полпути дольше session_ttl назад
+    async def expire_sessions(self):
+        deadline = time.time() - self.session_ttl
+        return await self._db.write(
+            lambda conn: conn.execute('DELETE FROM fsm_state WHERE updated_at < ?', (deadline,)).rowcount
+        )
+
+    async def _cleanup_loop(self):
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                expired = await self.expire_sessions()
+                if expired:
+                    log.info('Удалено устаревших состояний FSM: %s', expired)
+            except Exception:
+                log.exception('Не удалось удалить устаревшие состояния FSM')
+
+    async def close(self):
+        if self._started is None:
+            return
+        await self._started
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.flush()
+        self._db.close()
+        self._started = None
+
+    async def wait_closed(self):
+        pass
+
+
+def _create_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_state (
+            chat TEXT NOT NULL,
+            user TEXT NOT NULL,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            bucket TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (chat, user)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_fsm_state_updated ON fsm_state (updated_at)')
+
+
+def _write_records(conn, records, now):
+    empty = [key for key, record in records.items() if record == _EMPTY]
+    rows = [
+        (key[0], key[1], record['state'], json.dumps(record['data']), json.dumps(record['bucket']), now)
+        for key, record in records.items()
+        if record != _EMPTY
+    ]
+    conn.executemany('DELETE FROM fsm_state WHERE chat = ? AND user = ?', empty)
+    conn.executemany('''
+        INSERT INTO fsm_state (chat, user, state, data, bucket, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (chat, user) DO UPDATE SET
+            state = excluded.state, data = excluded.data,
+            bucket = excluded.bucket, updated_at = excluded.updated_at
+    ''', rows)
@@ -0,0 +1,148 @@
+import asyncio
+import csv
+import itertools
+import json
+import os
+
+from database import EXPORT_COLUMNS, add_listings, export_listings
+from validation import (
+    DESCRIPTION_MAX_LENGTH, TITLE_MAX_LENGTH, parse_category, parse_description, parse_price, parse_quantity,
+    parse_title
+)
+
+# Загрузка объявлений файлом CSV или JSONL и выгрузка в тех же форматах.
+# Файл читается построчно, а объявления вставляются пачками по
+# IMPORT_CHUNK_SIZE, каждая пачка — одна транзакция.
+
+IMPORT_FIELDS = ('title', 'description', 'category', 'shop_price', 'my_price', 'quantity', 'photo_id')
+REQUIRED_FIELDS = ('title', 'category', 'shop_price', 'my_price', 'quantity')
+IMPORT_CHUNK_SIZE = 500
+# Не больше стольких объявлений из одного файла
+IMPORT_MAX_ROWS = 5000
+# Сколько ошибок перечислять в отчёте
+IMPORT_MAX_ERRORS = 20
+
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+
+
+def detect_format(file_name):
+    return FORMATS.get(os.path.splitext(file_name or '')[1].lower())
+
+
+# Перебирает записи файла: (номер строки, словарь полей)
+def iter_records(stream, fmt):
+    if fmt == 'csv':
+        # Excel в русской локали сохраняет CSV с разделителем «;»
+        header = stream.readline()
+        delimiter = ';' if header.count(';') > header.count(',') else ','
+        reader = csv.DictReader(itertools.chain([header], stream), delimiter=delimiter)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            yield line_number, None
+            continue
+        yield line_number, record
+
+
+# Проверяет запись по тем же правилам, что и пошаговое создание объявления.
+# Возвращает кортеж для add_listings без user_id или бросает ValueError
+def validate_record(record, categories):
+    if not isinstance(record, dict):
+        raise ValueError('строка не является объектом JSON')
+    missing = [field for field in REQUIRED_FIELDS if record.get(field) in (None, '')]
+    if missing:
+        raise ValueError('не заполнено: ' + ', '.join(missing))
+
+    if not str(record['title']).strip():
+        raise ValueError('не заполнено: title')
+    try:
+        title = parse_title(record['title'])
+    except ValueError:
+        raise ValueError(f'title длиннее {TITLE_MAX_LENGTH} символов')
+    try:
+        category = parse_category(record['category'], categories)
+    except ValueError:
+        raise ValueError(f"неизвестная категория {record['category']!r}")
+    try:
+        shop_price = parse_price(record['shop_price'])
+        my_price = parse_price(record['my_price'])
+    except ValueError:
+        raise ValueError('цена должна быть числом больше 0')
+    try:
+        quantity = parse_quantity(record['quantity'])
+    except ValueError:
+        raise ValueError('количество должно быть целым числом больше 0')
+
+    description = record.get('description')
+    if description is not None:
+        try:
+            description = parse_description(description)
+        except ValueError:
+            raise ValueError(f'description длиннее {DESCRIPTION_MAX_LENGTH} символов')
+    photo_id = record.get('photo_id') or None
+    return (title, description, photo_id, category, shop_price, my_price, quantity)
+
+
+# Загружает объявления пользователя из текстового потока.
+# Возвращает {'imported': число, 'errors': [(строка, причина)], 'failed': число, 'truncated': bool}
+async def import_listings(user_id, stream, fmt, categories):
+    result = {'imported': 0, 'errors': [], 'failed': 0, 'truncated': False}
+    chunk = []
+
+    def fail(line_number, reason):
+        result['failed'] += 1
+        if len(result['errors']) < IMPORT_MAX_ERRORS:
+            result['errors'].append((line_number, reason))
+
+    try:
+        for processed, (line_number, record) in enumerate(iter_records(stream, fmt), 1):
+            if result['imported'] + len(chunk) >= IMPORT_MAX_ROWS:
+                result['truncated'] = True
+                break
+            if processed % IMPORT_CHUNK_SIZE == 0:
+                # Разбор идёт в цикле событий; даём поработать остальным обработчикам
+                await asyncio.sleep(0)
+            try:
+                chunk.append((user_id,) + validate_record(record, categories))
+            except ValueError as e:
+                fail(line_number, str(e))
+                continue
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                result['imported'] += await add_listings(chunk)
+                chunk = []
+    except (csv.Error, UnicodeDecodeError) as e:
+        fail(None, f'файл не разобран до конца: {e}')
+    if chunk:
+        result['imported'] += await add_listings(chunk)
+    return result
+
+
+def _write_csv(cursor, fileobj):
+    writer = csv.writer(fileobj)
+    writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    for row in cursor:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def _write_jsonl(cursor, fileobj):
+    count = 0
+    for row in cursor:
+        fileobj.write(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+
+# Пишет объявления пользователя (или весь одобренный каталог) в текстовый
+# файл fileobj; строки идут прямо из курсора. Возвращает их число
+async def write_export(fileobj, fmt, user_id=None):
+    writer = _write_csv if fmt == 'csv' else _write_jsonl
+    return await export_listings(lambda cursor: writer(cursor, fileobj), user_id)
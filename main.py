@@ -1,29 +1,140 @@
 import logging
-import sqlite3
-from aiogram import Bot, Dispatcher, executor, types
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram import Dispatcher, executor, types
+from aiogram.bot.api import TelegramAPIServer
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.callback_data import CallbackData
+from aiogram.utils.markdown import quote_html
 import asyncio
 from datetime import datetime
+import io
 import os
+import tempfile
+
+from database import (
+    db, role_cache, init_db, get_user_role, add_user, make_admin, notify_admins, add_listing,
+    get_approved_listings, get_catalog_page, get_moderation_page, moderate_listings,
+    get_listing_by_id, get_user_listings, get_user_archive, get_statistics, search_listings,
+    get_user_subscriptions, set_subscription, catalog, load_catalog, sync_catalog, sync_roles, ROLE_SYNC_INTERVAL
+)
+from archive import ArchiveJob
+from background import PeriodicTask
+from cache import MISSING, TTLCache
+from fanout import FanoutJob
+from fsm_storage import SQLiteStorage
+from listings_io import IMPORT_FIELDS, IMPORT_MAX_ROWS, detect_format, import_listings, write_export
+from metrics import Gauge, MetricsMiddleware, start_metrics_server
+from outbox import OutboxSender
+from profiling import PROFILE_MAX_SECONDS, PROFILE_SECONDS, start_profile
+from read_model import CatalogSync
+from sender import ScheduledBot
+from throttling import ThrottlingMiddleware, throttle
+from validation import (
+    DESCRIPTION_MAX_LENGTH, TITLE_MAX_LENGTH, parse_description, parse_price, parse_quantity, parse_title
+)
+from webhook_server import start_webhook
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 
-# Токен бота (замените на ваш)
-API_TOKEN = 'YOUR_BOT_TOKEN_HERE'
+# Токен бота (замените на ваш или задайте BOT_TOKEN)
+API_TOKEN = os.getenv('BOT_TOKEN', 'YOUR_BOT_TOKEN_HERE')
+
+# Режим запуска: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Настройки вебхука. Если WEBHOOK_URL пустой, вебхук не регистрируется в Telegram —
+# так сервер удобно проверять локально, отправляя ему записанные обновления
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBAPP_HOST = os.getenv('WEBAPP_HOST', '127.0.0.1')
+WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', '8080'))
+
+# Адрес Bot API (например, локального сервера для тестов); пустой — api.telegram.org
+BOT_API_SERVER = os.getenv('BOT_API_SERVER', '')
+
+# Файл с состояниями FSM (незаконченные объявления и т.п.); общий для всех процессов бота
+FSM_STORAGE_PATH = os.getenv('FSM_STORAGE_PATH', 'fsm_storage.db')
+
+# Метрики Prometheus на http://METRICS_HOST:METRICS_PORT/metrics; 0 — не запускать
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+
+# Число рабочих процессов. Больше 1 — обновления принимает отдельный процесс
+# и раздаёт их рабочим по пользователю; метрики рабочего i — на METRICS_PORT + i
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '1'))
 
 # Инициализация бота и диспетчера
-bot = Bot(token=API_TOKEN)
-storage = MemoryStorage()
+if BOT_API_SERVER:
+    bot = ScheduledBot(token=API_TOKEN, server=TelegramAPIServer.from_base(BOT_API_SERVER))
+else:
+    bot = ScheduledBot(token=API_TOKEN)
+storage = SQLiteStorage(FSM_STORAGE_PATH)
 dp = Dispatcher(bot, storage=storage)
+dp.middleware.setup(MetricsMiddleware())
+dp.middleware.setup(ThrottlingMiddleware())
+Gauge('bot_outbound_queue_depth', 'Исходящие запросы, ожидающие отправки', lambda: bot.scheduler.depth)
+Gauge('bot_catalog_listings', 'Одобренные объявления в памяти процесса', lambda: len(catalog))
+metrics_server = None
+# Фоновая отправка уведомлений из таблицы outbox
+outbox = OutboxSender(bot)
+# Перенос старых объявлений в архив и сжатие базы
+archiver = ArchiveJob()
+# Сверка каталога в памяти с базой
+catalog_sync = CatalogSync(sync_catalog)
+# Сверка кэша ролей с базой: роли меняют и другие процессы
+role_sync = PeriodicTask(sync_roles, ROLE_SYNC_INTERVAL, 'Не удалось сверить роли с базой')
 
 # Callback data для кнопок
 admin_cb = CallbackData('admin', 'action', 'listing_id')
 listing_cb = CallbackData('listing', 'action', 'listing_id')
+catalog_page_cb = CallbackData('page', 'category', 'sort', 'direction', 'cursor', 'page')
+search_cb = CallbackData('search', 'category', 'page')
+album_cb = CallbackData('album', 'category', 'sort', 'direction', 'cursor', 'page')
+moderation_cb = CallbackData('mod', 'action', 'listing_id')
+subscription_cb = CallbackData('sub', 'category')
+
+# Поиск
+SEARCH_QUERY_LIMIT = 100
+
+# Inline-режим
+INLINE_PAGE_SIZE = 20
+INLINE_CACHE_SIZE = 2000
+INLINE_CACHE_TTL = 30
+
+# Кэш карточек объявлений
+CARD_CACHE_SIZE = 5000
+CARD_CACHE_TTL = 600
+
+# Пагинация каталога
+CATALOG_PAGE_SIZE = 5
+CATALOG_DESCRIPTION_LIMIT = 200
+# Сколько символов названия оставлять, если карточка не помещается в сообщение
+CARD_TITLE_PREVIEW = 100
+
+# Сортировки каталога (ключи CATALOG_SORTS в database.py)
+SORT_NAMES = {
+    'new': '🆕 Новые',
+    'discount': '🔥 Скидка',
+    'cheap': '💸 Дешевле'
+}
+
+# Каталог с фото: объявлений на страницу и фото в одном альбоме
+ALBUM_PAGE_SIZE = 10
+ALBUM_SIZE = 10
+CAPTION_LIMIT = 1024
+MESSAGE_LIMIT = 4096
+
+# Очередь модерации: объявлений на странице
+MODERATION_PAGE_SIZE = 10
+
+# Сколько последних архивных объявлений показывать продавцу
+ARCHIVE_VIEW_LIMIT = 20
+
+# Все шаги создания объявления делят одно окно: 15 сообщений за 30 секунд
+throttle_wizard = throttle(15, 30, key='listing_wizard')
 
 # Категории товаров
 CATEGORIES = {
@@ -46,165 +157,8 @@ class ListingStates(StatesGroup):
 class AdminStates(StatesGroup):
     waiting_for_admin_id = State()
 
-# Инициализация базы данных
-def init_db():
-    conn = sqlite3.connect('marketplace_bot.db')
-    cursor = conn.cursor()
-    
-    # Таблица пользователей
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            role TEXT DEFAULT 'user',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Таблица объявлений
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS listings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            title TEXT NOT NULL,
-            description TEXT,
-            photo_id TEXT,
-            category TEXT NOT NULL,
-            shop_price REAL NOT NULL,
-            my_price REAL NOT NULL,
-            quantity INTEGER NOT NULL,
-            status TEXT DEFAULT 'pending',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            approved_at TIMESTAMP,
-            approved_by INTEGER,
-            FOREIGN KEY (user_id) REFERENCES users (user_id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-
-# Функции для работы с базой данных
-def get_user_role(user_id):
-    conn = sqlite3.connect('marketplace_bot.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT role FROM users WHERE user_id = ?', (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else None
-
-def add_user(user_id, username, first_name):
-    conn = sqlite3.connect('marketplace_bot.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT OR IGNORE INTO users (user_id, username, first_name)
-        VALUES (?, ?, ?)
-    ''', (user_id, username, first_name))
-    conn.commit()
-    conn.close()
-
-def make_admin(user_id):
-    conn = sqlite3.connect('marketplace_bot.db')
-    cursor = conn.cursor()
-    cursor.execute('UPDATE users SET role = ? WHERE user_id = ?', ('admin', user_id))
-    conn.commit()
-    conn.close()
-
-def add_listing(user_id, title, description, photo_id, category, shop_price, my_price, quantity):
-    conn = sqlite3.connect('marketplace_bot.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO listings (user_id, title, description, photo_id, category, shop_price, my_price, quantity)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (user_id, title, description, photo_id, category, shop_price, my_price, quantity))
-    listing_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return listing_id
-
-def get_pending_listings():
-    conn = sqlite3.connect('marketplace_bot.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT l.id, l.title, l.description, l.category, l.shop_price, l.my_price, l.quantity, u.username
-        FROM listings l
-        JOIN users u ON l.user_id = u.user_id
-        WHERE l.status = 'pending'
-        ORDER BY l.created_at
-    ''')
-    results = cursor.fetchall()
-    conn.close()
-    return results
-
-def get_approved_listings(category=None):
-    conn = sqlite3.connect('marketplace_bot.db')
-    cursor = conn.cursor()
-    
-    if category:
-        cursor.execute('''
-            SELECT l.id, l.title, l.description, l.photo_id, l.category, l.shop_price, l.my_price, l.quantity, u.username
-            FROM listings l
-            JOIN users u ON l.user_id = u.user_id
-            WHERE l.status = 'approved' AND l.category = ?
-            ORDER BY l.created_at DESC
-        ''', (category,))
-    else:
-        cursor.execute('''
-            SELECT l.id, l.title, l.description, l.photo_id, l.category, l.shop_price, l.my_price, l.quantity, u.username
-            FROM listings l
-            JOIN users u ON l.user_id = u.user_id
-            WHERE l.status = 'approved'
-            ORDER BY l.created_at DESC
-        ''')
-    
-    results = cursor.fetchall()
-    conn.close()
-    return results
-
-def approve_listing(listing_id, admin_id):
-    conn = sqlite3.connect('marketplace_bot.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE listings 
-        SET status = 'approved', approved_at = CURRENT_TIMESTAMP, approved_by = ?
-        WHERE id = ?
-    ''', (admin_id, listing_id))
-    conn.commit()
-    conn.close()
-
-def reject_listing(listing_id):
-    conn = sqlite3.connect('marketplace_bot.db')
-    cursor = conn.cursor()
-    cursor.execute('UPDATE listings SET status = ? WHERE id = ?', ('rejected', listing_id))
-    conn.commit()
-    conn.close()
-
-def get_listing_by_id(listing_id):
-    conn = sqlite3.connect('marketplace_bot.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT l.*, u.username, u.first_name
-        FROM listings l
-        JOIN users u ON l.user_id = u.user_id
-        WHERE l.id = ?
-    ''', (listing_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result
-
-def get_user_listings(user_id):
-    conn = sqlite3.connect('marketplace_bot.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, title, category, shop_price, my_price, quantity, status, created_at
-        FROM listings
-        WHERE user_id = ?
-        ORDER BY created_at DESC
-    ''', (user_id,))
-    results = cursor.fetchall()
-    conn.close()
-    return results
+class SearchStates(StatesGroup):
+    waiting_for_query = State()
 
 # Клавиатуры
 def get_main_keyboard(user_role):
@@ -224,9 +178,20 @@ def get_categories_keyboard():
     for category_key, category_name in CATEGORIES.items():
         keyboard.insert(InlineKeyboardButton(category_name, 
                                            callback_data=f"category_{category_key}"))
+    keyboard.add(InlineKeyboardButton("🔍 Поиск", callback_data="search_start"))
+    keyboard.add(InlineKeyboardButton("🔔 Подписки на категории", callback_data="subscriptions"))
     keyboard.add(InlineKeyboardButton("🔙 Назад", callback_data="back_to_catalog"))
     return keyboard
 
+def get_subscriptions_keyboard(subscribed):
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    for category_key, category_name in CATEGORIES.items():
+        mark = "🔔" if category_key in subscribed else "🔕"
+        keyboard.insert(InlineKeyboardButton(f"{mark} {category_name}", 
+                                           callback_data=subscription_cb.new(category=category_key)))
+    keyboard.add(InlineKeyboardButton("🔙 Назад к категориям", callback_data="back_to_catalog"))
+    return keyboard
+
 def get_category_selection_keyboard():
     keyboard = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
     for category_name in CATEGORIES.values():
@@ -238,9 +203,110 @@ def get_admin_keyboard():
     keyboard.add(KeyboardButton("📝 Ожидающие модерации"))
     keyboard.add(KeyboardButton("👤 Добавить админа"))
     keyboard.add(KeyboardButton("📊 Статистика"))
+    keyboard.add(KeyboardButton("📤 Выгрузка каталога"))
     keyboard.add(KeyboardButton("🔙 Главное меню"))
     return keyboard
 
+# Карточки объявлений. Готовые тексты и клавиатуры кэшируются по
+# (id объявления, вид карточки) и сбрасываются при смене статуса.
+card_cache = TTLCache(CARD_CACHE_SIZE, CARD_CACHE_TTL)
+
+def render_catalog_card(listing):
+    listing_id, title, description, photo_id, category, shop_price, my_price, quantity, username = listing
+    if description and len(description) > CATALOG_DESCRIPTION_LIMIT:
+        description = description[:CATALOG_DESCRIPTION_LIMIT] + '…'
+    
+    text = f"""<b>{quote_html(title)}</b>{' 📸' if photo_id else ''}
+👤 Продавец: @{username if username else 'Не указан'}
+📝 {quote_html(description or '')}
+💰 Цена магазина: {shop_price} ₽ | 💵 Моя цена: <b>{my_price} ₽</b>{format_discount(shop_price, my_price)}
+📦 Количество: {quantity} шт. | #товар_{listing_id}
+"""
+    return text, None
+
+# Та же формула, что у столбцов discount и discount_percent в базе
+def format_discount(shop_price, my_price):
+    if my_price >= shop_price:
+        return ''
+    discount = round(shop_price - my_price, 2)
+    return f" | 🔥 −{discount} ₽ ({round(discount * 100 / shop_price, 1)}%)"
+
+def render_moderation_card(listing):
+    listing_id, title, description, category, shop_price, my_price, quantity, username = listing
+    if description and len(description) > CATALOG_DESCRIPTION_LIMIT:
+        description = description[:CATALOG_DESCRIPTION_LIMIT] + '…'
+    
+    text = f"""#{listing_id} <b>{quote_html(title)}</b> · {CATEGORIES.get(category, 'Неизвестно')}
+👤 @{username if username else 'Не указан'} · 💰 {shop_price} ₽ → 💵 <b>{my_price} ₽</b> · 📦 {quantity} шт.
+📄 {quote_html(description or '')}
+"""
+    return text, None
+
+def render_details_card(listing):
+    (listing_id, user_id, title, description, photo_id, category, shop_price, my_price,
+     quantity, status, created_at, username, first_name) = listing
+    
+    text = f"""
+📋 <b>Подробная информация об объявлении #{listing_id}</b>
+
+👤 <b>Автор:</b> {quote_html(first_name or '')} (@{username if username else 'Не указан'})
+🆔 <b>ID автора:</b> {user_id}
+
+🛍️ <b>Название:</b> {quote_html(title)}
+📂 <b>Категория:</b> {CATEGORIES.get(category, 'Неизвестно')}
+📄 <b>Описание:</b> {quote_html(description or '')}
+
+💰 <b>Цена магазина:</b> {shop_price} ₽
+💵 <b>Моя цена:</b> {my_price} ₽
+📦 <b>Количество:</b> {quantity} шт.
+"""
+    return text, None
+
+# Статус в кэшированную карточку не входит: его меняет модерация в любом
+# процессе, а invalidate_cards сбрасывает кэш только в своём
+def format_details_status(listing):
+    status, created_at = listing[9], listing[10]
+    return f"""
+📊 <b>Статус:</b> {status}
+📅 <b>Создано:</b> {created_at[:16] if created_at else 'Не указано'}
+"""
+
+CARD_RENDERERS = {
+    'catalog': render_catalog_card,
+    'moderation': render_moderation_card,
+    'details': render_details_card,
+}
+
+def get_card(kind, listing):
+    key = (listing[0], kind)
+    card = card_cache.get(key)
+    if card is MISSING:
+        card = CARD_RENDERERS[kind](listing)
+        card_cache.set(key, card)
+    return card
+
+def invalidate_cards(listing_id):
+    for kind in CARD_RENDERERS:
+        card_cache.invalidate((listing_id, kind))
+
+# Заполняет кэш карточками, которые понадобятся при текущем статусе объявления.
+# listing — строка из get_listing_by_id
+def warm_cards(listing):
+    (listing_id, user_id, title, description, photo_id, category, shop_price, my_price,
+     quantity, status, created_at, username, first_name) = listing
+    
+    get_card('details', listing)
+    if status == 'pending':
+        get_card('moderation', (listing_id, title, description, category, shop_price, my_price, quantity, username))
+    elif status == 'approved':
+        get_card('catalog', (listing_id, title, description, photo_id, category, shop_price, my_price, quantity, username))
+
+async def warm_listing_cards(listing_ids):
+    for listing_id in listing_ids:
+        listing = await get_listing_by_id(listing_id)
+        if listing:
+            warm_cards(listing)
+
 # Обработчики команд
 @dp.message_handler(commands=['start'])
 async def cmd_start(message: types.Message):
@@ -248,8 +314,8 @@ async def cmd_start(message: types.Message):
     username = message.from_user.username
     first_name = message.from_user.first_name
     
-    add_user(user_id, username, first_name)
-    user_role = get_user_role(user_id)
+    await add_user(user_id, username, first_name)
+    user_role = await get_user_role(user_id)
     
     welcome_text = f"""
 🛍️ Добро пожаловать в торговую площадку!
@@ -257,6 +323,7 @@ async def cmd_start(message: types.Message):
 Вы можете:
 • Просматривать каталог товаров по категориям
 • Добавлять свои объявления
+• Загружать объявления файлом (/import) и выгружать их (/export)
 • Управлять своими товарами
 
 Ваша роль: {"Администратор" if user_role == 'admin' else "Пользователь"}
@@ -267,82 +334,340 @@ async def cmd_start(message: types.Message):
 # Главное меню
 @dp.message_handler(text="🔙 Главное меню")
 async def main_menu(message: types.Message):
-    user_role = get_user_role(message.from_user.id)
+    user_role = await get_user_role(message.from_user.id)
     await message.answer("Главное меню:", reply_markup=get_main_keyboard(user_role))
 
 # Каталог товаров
 @dp.message_handler(text="📱 Каталог товаров")
+@throttle(2, 3)
 async def show_catalog_categories(message: types.Message):
     text = "🛍️ Выберите категорию товаров:"
     await message.answer(text, reply_markup=get_categories_keyboard())
 
-@dp.callback_query_handler(lambda c: c.data.startswith('category_'))
-async def show_category_listings(callback_query: types.CallbackQuery):
-    category_key = callback_query.data.replace('category_', '')
+# Нумерованные карточки каталога под заголовком. Карточка, с которой текст
+# вместе с короткими строками оставшихся карточек превысил бы MESSAGE_LIMIT,
+# заменяется короткой строкой
+def format_catalog_cards(text, listings):
+    short = [
+        f"\n<b>{number}.</b> {quote_html(listing[1][:CARD_TITLE_PREVIEW])}… #товар_{listing[0]}\n"
+        for number, listing in enumerate(listings, 1)
+    ]
+    for number, listing in enumerate(listings, 1):
+        card_text, _ = get_card('catalog', listing)
+        card_text = f"\n<b>{number}.</b> {card_text}"
+        if len(text) + len(card_text) + sum(map(len, short[number:])) > MESSAGE_LIMIT:
+            card_text = short[number - 1]
+        text += card_text
+    return text
+
+def format_catalog_page(category_key, listings, page, sort):
     category_name = CATEGORIES.get(category_key, 'Неизвестная категория')
+    return format_catalog_cards(f"🛍️ <b>{category_name}</b> · {SORT_NAMES[sort]} — страница {page}\n", listings)
+
+def get_catalog_page_keyboard(category_key, listings, page, has_prev, has_next, sort):
+    keyboard = InlineKeyboardMarkup(row_width=CATALOG_PAGE_SIZE)
     
-    listings = get_approved_listings(category_key)
+    # Кнопки связи с продавцом — по одной на карточку страницы
+    for number, listing in enumerate(listings, 1):
+        keyboard.insert(InlineKeyboardButton(f"💬 {number}", 
+                                           callback_data=listing_cb.new(action='contact', listing_id=listing[0])))
+    
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton("⬅️ Назад", callback_data=catalog_page_cb.new(
+            category=category_key, sort=sort, direction='prev', cursor=listings[0][0], page=page - 1)))
+    if has_next:
+        navigation.append(InlineKeyboardButton("Вперёд ➡️", callback_data=catalog_page_cb.new(
+            category=category_key, sort=sort, direction='next', cursor=listings[-1][0], page=page + 1)))
+    if navigation:
+        keyboard.row(*navigation)
+    
+    # Переключатель сортировки; выбранная отмечена галочкой
+    keyboard.row(*(
+        InlineKeyboardButton(("✅ " if key == sort else "") + name, callback_data=catalog_page_cb.new(
+            category=category_key, sort=key, direction='first', cursor=0, page=1))
+        for key, name in SORT_NAMES.items()
+    ))
+    keyboard.row(InlineKeyboardButton("🖼 С фото", callback_data=album_cb.new(
+        category=category_key, sort=sort, direction='from', cursor=listings[0][0],
+        page=(page - 1) * CATALOG_PAGE_SIZE // ALBUM_PAGE_SIZE + 1)))
+    keyboard.row(InlineKeyboardButton("🔙 Назад к категориям", callback_data="back_to_catalog"))
+    return keyboard
+
+async def show_catalog_page(message, category_key, page=1, direction='first', cursor_id=None, sort='new'):
+    listings, has_prev, has_next = await get_catalog_page(
+        category_key, CATALOG_PAGE_SIZE, direction, cursor_id, sort)
+    # Если объявления-курсора уже нет, get_catalog_page вернула первую страницу
+    if not has_prev:
+        page = 1
     
     if not listings:
-        await callback_query.message.edit_text(
+        category_name = CATEGORIES.get(category_key, 'Неизвестная категория')
+        await message.edit_text(
             f"📭 В категории '{category_name}' пока нет товаров.",
             reply_markup=get_categories_keyboard()
         )
         return
     
-    await callback_query.message.delete()
-    
-    for listing in listings:
-        listing_id, title, description, photo_id, category, shop_price, my_price, quantity, username = listing
-        
-        text = f"""
-🛍️ <b>{title}</b>
-📂 Категория: {CATEGORIES.get(category, 'Неизвестно')}
-👤 Продавец: @{username if username else 'Не указан'}
+    await message.edit_text(
+        format_catalog_page(category_key, listings, page, sort),
+        parse_mode='HTML',
+        reply_markup=get_catalog_page_keyboard(category_key, listings, page, has_prev, has_next, sort)
+    )
 
-📝 {description}
+@dp.callback_query_handler(lambda c: c.data.startswith('category_'))
+@throttle(3, 3)
+async def show_category_listings(callback_query: types.CallbackQuery):
+    category_key = callback_query.data.replace('category_', '')
+    await show_catalog_page(callback_query.message, category_key)
+    await callback_query.answer()
 
-💰 <b>Цена магазина:</b> {shop_price} ₽
-💵 <b>Моя цена:</b> {my_price} ₽
-📦 <b>Количество:</b> {quantity} шт.
+@dp.callback_query_handler(catalog_page_cb.filter(sort=list(SORT_NAMES)))
+@throttle(5, 3)
+async def process_catalog_page(callback_query: types.CallbackQuery, callback_data: dict):
+    await show_catalog_page(
+        callback_query.message,
+        callback_data['category'],
+        page=int(callback_data['page']),
+        direction=callback_data['direction'],
+        cursor_id=int(callback_data['cursor']),
+        sort=callback_data['sort']
+    )
+    await callback_query.answer()
 
-#товар_{listing_id}
-        """
-        
-        keyboard = InlineKeyboardMarkup()
-        keyboard.add(InlineKeyboardButton("💬 Связаться с продавцом", 
-                                        callback_data=listing_cb.new(action='contact', listing_id=listing_id)))
-        
-        if photo_id:
-            await callback_query.message.answer_photo(photo_id, caption=text, parse_mode='HTML', reply_markup=keyboard)
+# Каталог с фото: подряд идущие объявления с фото уходят одним альбомом
+# (до 10 штук), объявления без фото — одним текстовым сообщением, а кнопки
+# связи с продавцом и навигация собраны в одну клавиатуру в конце
+def group_album_page(listings):
+    groups = []
+    for number, listing in enumerate(listings, 1):
+        has_photo = bool(listing[3])
+        if groups and groups[-1][0] == has_photo and (not has_photo or len(groups[-1][1]) < ALBUM_SIZE):
+            groups[-1][1].append((number, listing))
         else:
-            await callback_query.message.answer(text, parse_mode='HTML', reply_markup=keyboard)
+            groups.append((has_photo, [(number, listing)]))
+    return groups
+
+# Подпись к фото объявления (в альбоме — с номером). Если карточка длиннее
+# CAPTION_LIMIT, Telegram отклонит всё сообщение, поэтому остаётся только тег
+def get_photo_caption(listing, number=None):
+    prefix = f"<b>{number}.</b> " if number is not None else ""
+    card_text, _ = get_card('catalog', listing)
+    caption = prefix + card_text
+    if len(caption) > CAPTION_LIMIT:
+        caption = f"{prefix}#товар_{listing[0]}"
+    return caption
+
+def get_album_keyboard(category_key, listings, page, has_next, sort):
+    keyboard = InlineKeyboardMarkup(row_width=CATALOG_PAGE_SIZE)
+    
+    for number, listing in enumerate(listings, 1):
+        keyboard.insert(InlineKeyboardButton(f"💬 {number}", 
+                                           callback_data=listing_cb.new(action='contact', listing_id=listing[0])))
     
-    # Добавляем кнопку "Назад к категориям"
-    back_keyboard = InlineKeyboardMarkup()
-    back_keyboard.add(InlineKeyboardButton("🔙 Назад к категориям", callback_data="back_to_catalog"))
-    await callback_query.message.answer("Выберите другую категорию:", reply_markup=back_keyboard)
+    if has_next:
+        keyboard.row(InlineKeyboardButton("Ещё ➡️", callback_data=album_cb.new(
+            category=category_key, sort=sort, direction='next', cursor=listings[-1][0], page=page + 1)))
+    keyboard.row(
+        InlineKeyboardButton("📝 Списком", callback_data=catalog_page_cb.new(
+            category=category_key, sort=sort, direction='from', cursor=listings[0][0],
+            page=(page - 1) * ALBUM_PAGE_SIZE // CATALOG_PAGE_SIZE + 1)),
+        InlineKeyboardButton("🔙 Назад к категориям", callback_data="back_to_catalog")
+    )
+    return keyboard
+
+async def send_album_page(message, category_key, page, direction, cursor_id, sort):
+    listings, has_prev, has_next = await get_catalog_page(category_key, ALBUM_PAGE_SIZE, direction, cursor_id, sort)
+    if not has_prev:
+        page = 1
+    if not listings:
+        await message.answer("📭 Больше товаров нет.", reply_markup=get_categories_keyboard())
+        return
+    
+    for has_photo, group in group_album_page(listings):
+        if has_photo:
+            if len(group) == 1:
+                # В альбоме должно быть от 2 до 10 фото — одиночное отправляем отдельно
+                number, listing = group[0]
+                await message.answer_photo(listing[3], caption=get_photo_caption(listing, number), parse_mode='HTML')
+                continue
+            media = types.MediaGroup()
+            for number, listing in group:
+                media.attach_photo(listing[3], caption=get_photo_caption(listing, number), parse_mode='HTML')
+            await message.answer_media_group(media)
+        else:
+            text = ""
+            for number, listing in group:
+                card_text, _ = get_card('catalog', listing)
+                card_text = f"<b>{number}.</b> {card_text}\n"
+                if len(text) + len(card_text) > MESSAGE_LIMIT:
+                    await message.answer(text, parse_mode='HTML')
+                    text = ""
+                text += card_text
+            await message.answer(text, parse_mode='HTML')
+    
+    category_name = CATEGORIES.get(category_key, 'Неизвестная категория')
+    await message.answer(
+        f"🛍️ {category_name} — страница {page}. Выберите товар:",
+        reply_markup=get_album_keyboard(category_key, listings, page, has_next, sort)
+    )
+
+@dp.callback_query_handler(album_cb.filter(sort=list(SORT_NAMES)))
+@throttle(2, 5)
+async def process_album_page(callback_query: types.CallbackQuery, callback_data: dict):
+    await callback_query.answer()
+    # Убираем кнопки с предыдущего сообщения, чтобы навигация была только внизу
+    await callback_query.message.edit_reply_markup()
+    await send_album_page(
+        callback_query.message,
+        callback_data['category'],
+        int(callback_data['page']),
+        callback_data['direction'],
+        int(callback_data['cursor']),
+        callback_data['sort']
+    )
+
+# Подписки: о новых одобренных объявлениях в категории приходит сообщение
+@dp.callback_query_handler(lambda c: c.data == 'subscriptions')
+async def show_subscriptions(callback_query: types.CallbackQuery):
+    subscribed = await get_user_subscriptions(callback_query.from_user.id)
+    await callback_query.message.edit_text(
+        "🔔 <b>Подписки на категории</b>\n\n"
+        "Нажмите на категорию, чтобы получать сообщения о новых товарах в ней "
+        "или отказаться от них.",
+        parse_mode='HTML',
+        reply_markup=get_subscriptions_keyboard(subscribed)
+    )
+    await callback_query.answer()
+
+@dp.callback_query_handler(subscription_cb.filter(category=list(CATEGORIES)))
+async def toggle_subscription(callback_query: types.CallbackQuery, callback_data: dict):
+    user_id = callback_query.from_user.id
+    category_key = callback_data['category']
+    subscribed = await get_user_subscriptions(user_id)
+    
+    if category_key in subscribed:
+        await set_subscription(user_id, category_key, False)
+        subscribed.discard(category_key)
+        await callback_query.answer(f"🔕 Подписка на «{CATEGORIES[category_key]}» отменена")
+    else:
+        await set_subscription(user_id, category_key, True)
+        subscribed.add(category_key)
+        await callback_query.answer(f"🔔 Вы подписаны на «{CATEGORIES[category_key]}»")
+    
+    await callback_query.message.edit_reply_markup(get_subscriptions_keyboard(subscribed))
 
 @dp.callback_query_handler(lambda c: c.data == 'back_to_catalog')
 async def back_to_catalog(callback_query: types.CallbackQuery):
     text = "🛍️ Выберите категорию товаров:"
     await callback_query.message.edit_text(text, reply_markup=get_categories_keyboard())
 
+# Поиск по объявлениям
+def format_search_page(query, listings, page):
+    return format_catalog_cards(f"🔍 <b>Поиск:</b> {quote_html(query)} — страница {page}\n", listings)
+
+def get_search_keyboard(listings, category, page, has_next):
+    keyboard = InlineKeyboardMarkup(row_width=CATALOG_PAGE_SIZE)
+    
+    for number, listing in enumerate(listings, 1):
+        keyboard.insert(InlineKeyboardButton(f"💬 {number}", 
+                                           callback_data=listing_cb.new(action='contact', listing_id=listing[0])))
+    
+    # Фильтр по категории
+    filters = [InlineKeyboardButton(("✅ " if category == 'all' else "") + "Все", 
+                                    callback_data=search_cb.new(category='all', page=1))]
+    for category_key, category_name in CATEGORIES.items():
+        filters.append(InlineKeyboardButton(("✅ " if category == category_key else "") + category_name, 
+                                            callback_data=search_cb.new(category=category_key, page=1)))
+    keyboard.row(*filters[:3])
+    keyboard.row(*filters[3:])
+    
+    navigation = []
+    if page > 1:
+        navigation.append(InlineKeyboardButton("⬅️ Назад", callback_data=search_cb.new(category=category, page=page - 1)))
+    if has_next:
+        navigation.append(InlineKeyboardButton("Вперёд ➡️", callback_data=search_cb.new(category=category, page=page + 1)))
+    if navigation:
+        keyboard.row(*navigation)
+    
+    keyboard.row(InlineKeyboardButton("🔙 Назад к категориям", callback_data="back_to_catalog"))
+    return keyboard
+
+async def render_search(query, category='all', page=1):
+    listings, has_next = await search_listings(
+        query, CATALOG_PAGE_SIZE, page, None if category == 'all' else category
+    )
+    if not listings and page == 1:
+        keyboard = get_search_keyboard([], category, 1, False)
+        return f"📭 По запросу «{quote_html(query)}» ничего не найдено.", keyboard
+    return format_search_page(query, listings, page), get_search_keyboard(listings, category, page, has_next)
+
+@dp.message_handler(commands=['search'])
+async def cmd_search(message: types.Message, state: FSMContext):
+    query = message.get_args()
+    if not query:
+        await SearchStates.waiting_for_query.set()
+        await message.answer("🔍 Введите поисковый запрос:")
+        return
+    await send_search_results(message, state, query)
+
+@dp.callback_query_handler(lambda c: c.data == 'search_start')
+async def search_start(callback_query: types.CallbackQuery):
+    await SearchStates.waiting_for_query.set()
+    await callback_query.message.answer("🔍 Введите поисковый запрос:")
+    await callback_query.answer()
+
+@dp.message_handler(state=SearchStates.waiting_for_query)
+async def process_search_query(message: types.Message, state: FSMContext):
+    await state.reset_state(with_data=False)
+    await send_search_results(message, state, message.text or '')
+
+async def send_search_results(message, state, query):
+    query = query.strip()[:SEARCH_QUERY_LIMIT]
+    await state.update_data(search_query=query)
+    text, keyboard = await render_search(query)
+    await message.answer(text, parse_mode='HTML', reply_markup=keyboard)
+
+@dp.callback_query_handler(search_cb.filter())
+async def process_search_page(callback_query: types.CallbackQuery, callback_data: dict, state: FSMContext):
+    data = await state.get_data()
+    query = data.get('search_query')
+    if not query:
+        await callback_query.answer("Поиск устарел, выполните его заново: /search", show_alert=True)
+        return
+    text, keyboard = await render_search(query, callback_data['category'], int(callback_data['page']))
+    await callback_query.message.edit_text(text, parse_mode='HTML', reply_markup=keyboard)
+    await callback_query.answer()
+
 # Добавление объявления
 @dp.message_handler(text="➕ Добавить объявление")
+@throttle_wizard
 async def start_add_listing(message: types.Message):
     await ListingStates.waiting_for_title.set()
     await message.answer("📝 Введите название товара:")
 
 @dp.message_handler(state=ListingStates.waiting_for_title)
+@throttle_wizard
 async def process_title(message: types.Message, state: FSMContext):
-    await state.update_data(title=message.text)
+    try:
+        title = parse_title(message.text)
+    except ValueError:
+        await message.answer(f"❌ Название должно быть не длиннее {TITLE_MAX_LENGTH} символов. Введите название товара:")
+        return
+    await state.update_data(title=title)
     await ListingStates.waiting_for_description.set()
     await message.answer("📄 Введите описание товара:")
 
 @dp.message_handler(state=ListingStates.waiting_for_description)
+@throttle_wizard
 async def process_description(message: types.Message, state: FSMContext):
-    await state.update_data(description=message.text)
+    try:
+        description = parse_description(message.text)
+    except ValueError:
+        await message.answer(f"❌ Описание должно быть не длиннее {DESCRIPTION_MAX_LENGTH} символов. "
+                             "Введите описание товара:")
+        return
+    await state.update_data(description=description)
     await ListingStates.waiting_for_photo.set()
     
     skip_keyboard = ReplyKeyboardMarkup(resize_keyboard=True)
@@ -352,6 +677,7 @@ async def process_description(message: types.Message, state: FSMContext):
                         reply_markup=skip_keyboard)
 
 @dp.message_handler(content_types=['photo'], state=ListingStates.waiting_for_photo)
+@throttle_wizard
 async def process_photo(message: types.Message, state: FSMContext):
     photo_id = message.photo[-1].file_id
     await state.update_data(photo_id=photo_id)
@@ -360,6 +686,7 @@ async def process_photo(message: types.Message, state: FSMContext):
                         reply_markup=get_category_selection_keyboard())
 
 @dp.message_handler(text="⏭️ Пропустить фото", state=ListingStates.waiting_for_photo)
+@throttle_wizard
 async def skip_photo(message: types.Message, state: FSMContext):
     await state.update_data(photo_id=None)
     await ListingStates.waiting_for_category.set()
@@ -367,6 +694,7 @@ async def skip_photo(message: types.Message, state: FSMContext):
                         reply_markup=get_category_selection_keyboard())
 
 @dp.message_handler(lambda message: message.text in CATEGORIES.values(), state=ListingStates.waiting_for_category)
+@throttle_wizard
 async def process_category(message: types.Message, state: FSMContext):
     # Находим ключ категории по названию
     category_key = None
@@ -384,11 +712,10 @@ async def process_category(message: types.Message, state: FSMContext):
         await message.answer("❌ Пожалуйста, выберите категорию из предложенных вариантов.")
 
 @dp.message_handler(state=ListingStates.waiting_for_shop_price)
+@throttle_wizard
 async def process_shop_price(message: types.Message, state: FSMContext):
     try:
-        shop_price = float(message.text.replace(',', '.'))
-        if shop_price <= 0:
-            raise ValueError
+        shop_price = parse_price(message.text)
         await state.update_data(shop_price=shop_price)
         await ListingStates.waiting_for_my_price.set()
         await message.answer("💵 Введите вашу цену (в рублях):")
@@ -396,11 +723,10 @@ async def process_shop_price(message: types.Message, state: FSMContext):
         await message.answer("❌ Пожалуйста, введите корректную цену (число больше 0):")
 
 @dp.message_handler(state=ListingStates.waiting_for_my_price)
+@throttle_wizard
 async def process_my_price(message: types.Message, state: FSMContext):
     try:
-        my_price = float(message.text.replace(',', '.'))
-        if my_price <= 0:
-            raise ValueError
+        my_price = parse_price(message.text)
         await state.update_data(my_price=my_price)
         await ListingStates.waiting_for_quantity.set()
         await message.answer("📦 Введите количество товара:")
@@ -408,27 +734,32 @@ async def process_my_price(message: types.Message, state: FSMContext):
         await message.answer("❌ Пожалуйста, введите корректную цену (число больше 0):")
 
 @dp.message_handler(state=ListingStates.waiting_for_quantity)
+@throttle_wizard
 async def process_quantity(message: types.Message, state: FSMContext):
     try:
-        quantity = int(message.text)
-        if quantity <= 0:
-            raise ValueError
+        quantity = parse_quantity(message.text)
         
         data = await state.get_data()
-        listing_id = add_listing(
+        # Уведомление админам о новом объявлении ставится в очередь вместе с ним
+        listing_id = await add_listing(
             message.from_user.id,
             data['title'],
             data['description'],
             data.get('photo_id'),
             data['category'],
             data['shop_price'],
-            my_price,
-            quantity
+            data['my_price'],
+            quantity,
+            admin_notice=lambda listing_id: format_new_listing_notice(
+                listing_id, data['title'], data['category'], message.from_user.username
+            )
         )
+        outbox.wake()
+        await warm_listing_cards([listing_id])
         
         await state.finish()
         
-        user_role = get_user_role(message.from_user.id)
+        user_role = await get_user_role(message.from_user.id)
         category_name = CATEGORIES.get(data['category'], 'Неизвестно')
         await message.answer(
             f"✅ Объявление создано! ID: {listing_id}\n"
@@ -437,19 +768,19 @@ async def process_quantity(message: types.Message, state: FSMContext):
             reply_markup=get_main_keyboard(user_role)
         )
         
-        # Уведомление админам о новом объявлении
-        await notify_admins_new_listing(listing_id)
-        
     except ValueError:
         await message.answer("❌ Пожалуйста, введите корректное количество (целое число больше 0):")
 
 # Мои объявления
 @dp.message_handler(text="📋 Мои объявления")
 async def show_my_listings(message: types.Message):
-    user_listings = get_user_listings(message.from_user.id)
+    user_listings = await get_user_listings(message.from_user.id)
+    # Архив загружается только по кнопке
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(InlineKeyboardButton("🗄 Архив", callback_data="my_archive"))
     
     if not user_listings:
-        await message.answer("📭 У вас пока нет объявлений.")
+        await message.answer("📭 У вас пока нет объявлений.", reply_markup=keyboard)
         return
     
     text = "📋 <b>Ваши объявления:</b>\n\n"
@@ -476,12 +807,154 @@ async def show_my_listings(message: types.Message):
         text += f"📊 Статус: {status_text.get(status, 'Неизвестно')}\n"
         text += f"📅 Создано: {created_at[:16]}\n\n"
     
-    await message.answer(text, parse_mode='HTML')
+    await message.answer(text, parse_mode='HTML', reply_markup=keyboard)
+
+# Архив: отклонённые и снятые по сроку объявления продавца
+@dp.callback_query_handler(lambda c: c.data == 'my_archive')
+async def show_my_archive(callback_query: types.CallbackQuery):
+    archived = await get_user_archive(callback_query.from_user.id, ARCHIVE_VIEW_LIMIT)
+    await callback_query.answer()
+    
+    if not archived:
+        await callback_query.message.answer("🗄 Архив пуст.")
+        return
+    
+    reason_text = {
+        'rejected': 'отклонено',
+        'expired': 'снято по сроку'
+    }
+    
+    text = f"🗄 <b>Архив (последние {ARCHIVE_VIEW_LIMIT}):</b>\n\n"
+    for listing in archived:
+        listing_id, title, category, shop_price, my_price, quantity, status, created_at, archived_at, reason = listing
+        entry = (
+            f"<b>{quote_html(title)}</b>\n"
+            f"📂 Категория: {CATEGORIES.get(category, 'Неизвестно')}\n"
+            f"💰 Цена магазина: {shop_price} ₽ | Моя цена: {my_price} ₽\n"
+            f"📅 Создано: {created_at[:16]} | В архиве с {archived_at[:16]}\n"
+            f"📊 Причина: {reason_text.get(reason, reason)}\n\n"
+        )
+        # Обрезать HTML нельзя — записи, которые не помещаются, не показываем
+        if len(text) + len(entry) > MESSAGE_LIMIT:
+            break
+        text += entry
+    
+    await callback_query.message.answer(text, parse_mode='HTML')
+
+# Загрузка объявлений файлом: CSV или JSONL с полями IMPORT_FIELDS.
+# Файл скачивается во временный файл и разбирается построчно
+@dp.message_handler(commands=['import'])
+async def cmd_import(message: types.Message):
+    categories = ", ".join(CATEGORIES)
+    await message.answer(
+        "📥 <b>Загрузка объявлений файлом</b>\n\n"
+        "Пришлите документ .csv или .jsonl. Поля:\n"
+        f"<code>{', '.join(IMPORT_FIELDS)}</code>\n\n"
+        f"category — одна из: {categories}; description и photo_id можно не заполнять.\n"
+        f"title — до {TITLE_MAX_LENGTH} символов, description — до {DESCRIPTION_MAX_LENGTH}.\n"
+        f"Не больше {IMPORT_MAX_ROWS} объявлений в одном файле. Каждое проходит модерацию.\n\n"
+        "Пример строки JSONL:\n"
+        '<code>{"title": "Чайник", "category": "other", "shop_price": 2500, '
+        '"my_price": 1800, "quantity": 2}</code>',
+        parse_mode='HTML'
+    )
+
+def format_import_report(result):
+    text = f"📥 Загружено объявлений: {result['imported']}. Они ожидают модерации.\n"
+    if result['truncated']:
+        text += f"⚠️ Обработаны только первые {IMPORT_MAX_ROWS} объявлений файла.\n"
+    if result['failed']:
+        text += f"\n❌ Пропущено строк с ошибками: {result['failed']}\n"
+        for line_number, reason in result['errors']:
+            text += f"• {'строка ' + str(line_number) if line_number else 'файл'}: {quote_html(reason)}\n"
+        if result['failed'] > len(result['errors']):
+            text += "…\n"
+    return text[:MESSAGE_LIMIT]
+
+@dp.message_handler(content_types=['document'])
+async def process_import_file(message: types.Message):
+    fmt = detect_format(message.document.file_name)
+    if fmt is None:
+        await message.answer("❌ Пришлите файл .csv или .jsonl. Подробнее: /import")
+        return
+    
+    await add_user(message.from_user.id, message.from_user.username, message.from_user.first_name)
+    await message.answer("⏳ Загружаю объявления...")
+    with tempfile.TemporaryFile() as raw:
+        await message.document.download(destination_file=raw)
+        stream = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+        result = await import_listings(message.from_user.id, stream, fmt, CATEGORIES)
+        stream.detach()
+    
+    await message.answer(format_import_report(result), parse_mode='HTML')
+    if result['imported']:
+        username = message.from_user.username
+        await notify_admins(
+            f"🔔 <b>{result['imported']} новых объявлений для модерации</b> "
+            f"от @{username if username else 'Не указан'} (загружены файлом).\n\n"
+            "Перейдите в админ панель для модерации."
+        )
+        outbox.wake()
+
+# Выгрузка объявлений: строки пишутся во временный файл прямо из курсора
+async def send_export(message, fmt, user_id=None):
+    file_name = f"{'listings' if user_id is not None else 'catalog'}.{fmt}"
+    with tempfile.TemporaryFile() as raw:
+        # utf-8-sig — чтобы Excel правильно открыл русский текст в CSV
+        stream = io.TextIOWrapper(raw, encoding='utf-8-sig' if fmt == 'csv' else 'utf-8', newline='')
+        count = await write_export(stream, fmt, user_id)
+        stream.flush()
+        stream.detach()
+        if not count:
+            await message.answer("📭 Выгружать нечего.")
+            return
+        raw.seek(0)
+        await message.answer_document(types.InputFile(raw, filename=file_name),
+                                      caption=f"📤 Объявлений в файле: {count}")
+
+def get_export_format(message):
+    return 'jsonl' if message.get_args().strip().lower() in ('jsonl', 'json') else 'csv'
+
+@dp.message_handler(commands=['export'])
+async def cmd_export(message: types.Message):
+    await send_export(message, get_export_format(message), message.from_user.id)
+
+@dp.message_handler(commands=['export_catalog'])
+@dp.message_handler(text="📤 Выгрузка каталога")
+async def cmd_export_catalog(message: types.Message):
+    user_role = await get_user_role(message.from_user.id)
+    if user_role != 'admin':
+        await message.answer("❌ У вас нет прав администратора.")
+        return
+    
+    await send_export(message, get_export_format(message) if message.is_command() else 'csv')
+
+# Профилирование работающего бота: /profile [секунды]. Отчёт с самыми
+# горячими функциями, задержкой цикла событий и числом задач приходит файлом
+@dp.message_handler(commands=['profile'])
+async def cmd_profile(message: types.Message):
+    user_role = await get_user_role(message.from_user.id)
+    if user_role != 'admin':
+        await message.answer("❌ У вас нет прав администратора.")
+        return
+    
+    args = message.get_args().strip()
+    seconds = min(max(int(args), 1), PROFILE_MAX_SECONDS) if args.isdigit() else PROFILE_SECONDS
+    
+    async def send_report(summary, report):
+        file_name = f"profile-{datetime.now():%Y%m%d-%H%M%S}.txt"
+        await message.answer_document(types.InputFile(io.BytesIO(report.encode('utf-8')), filename=file_name),
+                                      caption=summary)
+    
+    if not start_profile(seconds, send_report):
+        await message.answer("⏳ Профилирование уже идёт, дождитесь отчёта.")
+        return
+    await message.answer(f"⏱ Профилирование запущено на {seconds} с. Отчёт придёт файлом.")
 
 # Админ панель
 @dp.message_handler(text="⚙️ Админ панель")
 async def admin_panel(message: types.Message):
-    user_role = get_user_role(message.from_user.id)
+    user_role = await get_user_role(message.from_user.id)
     if user_role != 'admin':
         await message.answer("❌ У вас нет прав администратора.")
         return
@@ -490,56 +963,158 @@ async def admin_panel(message: types.Message):
                         parse_mode='HTML', 
                         reply_markup=get_admin_keyboard())
 
+# Очередь модерации: страница объявлений с отметками, выбранные одобряются
+# или отклоняются одной транзакцией. Состояние страницы (id на ней и
+# отмеченные) хранится в данных FSM администратора.
+def format_moderation_page(listings, page, pending_count):
+    text = f"📝 <b>Модерация</b> — страница {page}, ожидают: {pending_count}\n"
+    for number, listing in enumerate(listings, 1):
+        card_text, _ = get_card('moderation', listing)
+        card_text = f"\n<b>{number}.</b> {card_text}"
+        if len(text) + len(card_text) > MESSAGE_LIMIT:
+            card_text = f"\n<b>{number}.</b> #{listing[0]} — подробнее по кнопке 👁️\n"
+        text += card_text
+    return text
+
+def get_moderation_keyboard(moderation):
+    keyboard = InlineKeyboardMarkup()
+    selected = set(moderation['selected'])
+    
+    for number, listing_id in enumerate(moderation['ids'], 1):
+        mark = "☑️" if listing_id in selected else "⬜"
+        keyboard.row(
+            InlineKeyboardButton(f"{mark} {number} · #{listing_id}", 
+                                 callback_data=moderation_cb.new(action='toggle', listing_id=listing_id)),
+            InlineKeyboardButton("👁️", callback_data=admin_cb.new(action='details', listing_id=listing_id))
+        )
+    
+    keyboard.row(
+        InlineKeyboardButton("☑️ Все", callback_data=moderation_cb.new(action='all', listing_id=0)),
+        InlineKeyboardButton("⬜ Снять", callback_data=moderation_cb.new(action='none', listing_id=0))
+    )
+    keyboard.row(
+        InlineKeyboardButton(f"✅ Одобрить ({len(selected)})", 
+                             callback_data=moderation_cb.new(action='approve', listing_id=0)),
+        InlineKeyboardButton(f"❌ Отклонить ({len(selected)})", 
+                             callback_data=moderation_cb.new(action='reject', listing_id=0))
+    )
+    
+    navigation = []
+    if moderation['page'] > 1:
+        navigation.append(InlineKeyboardButton("⏮ В начало", callback_data=moderation_cb.new(action='first', listing_id=0)))
+    if moderation['has_next']:
+        navigation.append(InlineKeyboardButton("Вперёд ➡️", callback_data=moderation_cb.new(
+            action='next', listing_id=moderation['ids'][-1])))
+    if navigation:
+        keyboard.row(*navigation)
+    return keyboard
+
+# Загружает страницу очереди, запоминает её в FSM и показывает.
+# message — сообщение бота, которое нужно отредактировать, или None для нового
+async def show_moderation_page(chat_message, state, page=1, direction='first', cursor_id=None, message=None):
+    listings, has_next = await get_moderation_page(MODERATION_PAGE_SIZE, direction, cursor_id)
+    if not listings and direction != 'first':
+        # Страница опустела (её разобрали другие администраторы) — начинаем сначала
+        page = 1
+        listings, has_next = await get_moderation_page(MODERATION_PAGE_SIZE)
+    
+    if not listings:
+        await state.update_data(moderation=None)
+        text = "📭 Нет объявлений, ожидающих модерации."
+        if message is not None:
+            await message.edit_text(text)
+        else:
+            await chat_message.answer(text)
+        return
+    
+    statistics = await get_statistics()
+    text = format_moderation_page(listings, page, statistics['pending_listings'])
+    moderation = {
+        'page': page,
+        'ids': [listing[0] for listing in listings],
+        'selected': [],
+        'has_next': has_next,
+        'message_id': None,
+    }
+    keyboard = get_moderation_keyboard(moderation)
+    if message is not None:
+        await message.edit_text(text, parse_mode='HTML', reply_markup=keyboard)
+    else:
+        message = await chat_message.answer(text, parse_mode='HTML', reply_markup=keyboard)
+    moderation['message_id'] = message.message_id
+    await state.update_data(moderation=moderation)
+
 # Ожидающие модерации
 @dp.message_handler(text="📝 Ожидающие модерации")
-async def show_pending_listings(message: types.Message):
-    user_role = get_user_role(message.from_user.id)
+async def show_pending_listings(message: types.Message, state: FSMContext):
+    user_role = await get_user_role(message.from_user.id)
     if user_role != 'admin':
         await message.answer("❌ У вас нет прав администратора.")
         return
     
-    pending_listings = get_pending_listings()
+    await show_moderation_page(message, state)
+
+@dp.callback_query_handler(moderation_cb.filter(), state='*')
+@throttle(60, 10)
+async def process_moderation_callback(callback_query: types.CallbackQuery, callback_data: dict, state: FSMContext):
+    user_role = await get_user_role(callback_query.from_user.id)
+    if user_role != 'admin':
+        await callback_query.answer("❌ У вас нет прав администратора.", show_alert=True)
+        return
+    
+    action = callback_data['action']
+    message = callback_query.message
+    moderation = (await state.get_data()).get('moderation')
     
-    if not pending_listings:
-        await message.answer("📭 Нет объявлений, ожидающих модерации.")
+    if action == 'next' and moderation:
+        await show_moderation_page(message, state, moderation['page'] + 1, 'next',
+                                   int(callback_data['listing_id']), message=message)
+        await callback_query.answer()
+        return
+    if action == 'first' or not moderation or moderation['message_id'] != message.message_id:
+        # Устаревшее сообщение со списком — показываем актуальную очередь
+        await show_moderation_page(message, state, message=message)
+        await callback_query.answer("🔄 Список обновлён" if action != 'first' else None)
         return
     
-    for listing in pending_listings:
-        listing_id, title, description, category, shop_price, my_price, quantity, username = listing
-        
-        category_name = CATEGORIES.get(category, 'Неизвестно')
-        
-        text = f"""
-📝 <b>Новое объявление #{listing_id}</b>
-👤 Автор: @{username if username else 'Не указан'}
-
-🛍️ <b>{title}</b>
-📂 Категория: {category_name}
-📄 {description}
-
-💰 <b>Цена магазина:</b> {shop_price} ₽
-💵 <b>Моя цена:</b> {my_price} ₽
-📦 <b>Количество:</b> {quantity} шт.
-        """
-        
-        keyboard = InlineKeyboardMarkup(row_width=2)
-        keyboard.add(
-            InlineKeyboardButton("✅ Одобрить", 
-                               callback_data=admin_cb.new(action='approve', listing_id=listing_id)),
-            InlineKeyboardButton("❌ Отклонить", 
-                               callback_data=admin_cb.new(action='reject', listing_id=listing_id))
-        )
-        keyboard.add(
-            InlineKeyboardButton("👁️ Подробнее", 
-                               callback_data=admin_cb.new(action='details', listing_id=listing_id))
-        )
-        
-        await message.answer(text, parse_mode='HTML', reply_markup=keyboard)
+    if action in ('toggle', 'all', 'none'):
+        if action == 'toggle':
+            listing_id = int(callback_data['listing_id'])
+            selected = moderation['selected']
+            if listing_id in selected:
+                selected.remove(listing_id)
+            elif listing_id in moderation['ids']:
+                selected.append(listing_id)
+        else:
+            moderation['selected'] = list(moderation['ids']) if action == 'all' else []
+        await state.update_data(moderation=moderation)
+        await message.edit_reply_markup(get_moderation_keyboard(moderation))
+        await callback_query.answer()
+        return
+    
+    if not moderation['selected']:
+        await callback_query.answer("Отметьте объявления в списке", show_alert=True)
+        return
+    
+    status = 'approved' if action == 'approve' else 'rejected'
+    moderated = await moderate_listings(moderation['selected'], status, callback_query.from_user.id,
+                                        author_notices=lambda moderated: format_author_notices(moderated, status))
+    outbox.wake()
+    fanout.wake()
+    for listing_id, _, _ in moderated:
+        invalidate_cards(listing_id)
+    if status == 'approved':
+        await warm_listing_cards([listing_id for listing_id, _, _ in moderated])
+    
+    verb = "Одобрено" if status == 'approved' else "Отклонено"
+    await callback_query.answer(f"{verb}: {len(moderated)}")
+    # Перечитываем ту же страницу: обработанные объявления из неё ушли
+    await show_moderation_page(message, state, moderation['page'], 'from', moderation['ids'][0], message=message)
 
 # Добавить админа
 @dp.message_handler(text="👤 Добавить админа")
 async def add_admin_start(message: types.Message):
-    user_role = get_user_role(message.from_user.id)
+    user_role = await get_user_role(message.from_user.id)
     if user_role != 'admin':
         await message.answer("❌ У вас нет прав администратора.")
         return
@@ -551,7 +1126,7 @@ async def add_admin_start(message: types.Message):
 async def process_admin_id(message: types.Message, state: FSMContext):
     try:
         user_id = int(message.text)
-        make_admin(user_id)
+        await make_admin(user_id)
         await state.finish()
         await message.answer(f"✅ Пользователь {user_id} назначен администратором.")
     except ValueError:
@@ -560,65 +1135,41 @@ async def process_admin_id(message: types.Message, state: FSMContext):
 # Статистика
 @dp.message_handler(text="📊 Статистика")
 async def show_statistics(message: types.Message):
-    user_role = get_user_role(message.from_user.id)
+    user_role = await get_user_role(message.from_user.id)
     if user_role != 'admin':
         await message.answer("❌ У вас нет прав администратора.")
         return
     
-    conn = sqlite3.connect('marketplace_bot.db')
-    cursor = conn.cursor()
-    
-    # Статистика пользователей
-    cursor.execute('SELECT COUNT(*) FROM users')
-    total_users = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM users WHERE role = "admin"')
-    total_admins = cursor.fetchone()[0]
-    
-    # Статистика объявлений
-    cursor.execute('SELECT COUNT(*) FROM listings')
-    total_listings = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM listings WHERE status = "pending"')
-    pending_listings = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM listings WHERE status = "approved"')
-    approved_listings = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COUNT(*) FROM listings WHERE status = "rejected"')
-    rejected_listings = cursor.fetchone()[0]
-    
-    # Статистика по категориям
-    cursor.execute('''
-        SELECT category, COUNT(*) 
-        FROM listings 
-        WHERE status = "approved" 
-        GROUP BY category
-    ''')
-    category_stats = cursor.fetchall()
-    
-    conn.close()
+    stats = await get_statistics()
     
     text = f"""
 📊 <b>Статистика бота</b>
 
 👥 <b>Пользователи:</b>
-• Всего: {total_users}
-• Администраторов: {total_admins}
+• Всего: {stats['total_users']}
+• Администраторов: {stats['total_admins']}
 
 📝 <b>Объявления:</b>
-• Всего: {total_listings}
-• На модерации: {pending_listings}
-• Одобрено: {approved_listings}
-• Отклонено: {rejected_listings}
+• Всего: {stats['total_listings']}
+• На модерации: {stats['pending_listings']}
+• Одобрено: {stats['approved_listings']}
+• Отклонено: {stats['rejected_listings']}
+• В архиве: {stats['archived_listings']}
 
 📂 <b>По категориям (одобренные):</b>
 """
     
-    for category_key, count in category_stats:
+    for category_key, count in stats['category_stats']:
         category_name = CATEGORIES.get(category_key, 'Неизвестно')
         text += f"• {category_name}: {count}\n"
     
+    role_stats = role_cache.stats()
+    text += f"""
+⚡ <b>Кэш ролей:</b>
+• Попаданий: {role_stats['hits']} ({role_stats['hit_rate']:.0%})
+• Промахов: {role_stats['misses']}
+"""
+    
     await message.answer(text, parse_mode='HTML')
 
 # Обработчики callback'ов
@@ -627,65 +1178,34 @@ async def process_admin_callback(callback_query: types.CallbackQuery, callback_d
     action = callback_data['action']
     listing_id = int(callback_data['listing_id'])
     
-    user_role = get_user_role(callback_query.from_user.id)
+    user_role = await get_user_role(callback_query.from_user.id)
     if user_role != 'admin':
         await callback_query.answer("❌ У вас нет прав администратора.", show_alert=True)
         return
     
-    if action == 'approve':
-        approve_listing(listing_id, callback_query.from_user.id)
-        await callback_query.answer("✅ Объявление одобрено!", show_alert=True)
-        
-        # Уведомить автора объявления
-        listing = get_listing_by_id(listing_id)
-        if listing:
-            try:
-                await bot.send_message(
-                    listing[1],  # user_id
-                    f"✅ Ваше объявление '{listing[2]}' было одобрено и опубликовано!"
-                )
-            except:
-                pass
-        
-        await callback_query.message.edit_reply_markup()
-    
-    elif action == 'reject':
-        reject_listing(listing_id)
-        await callback_query.answer("❌ Объявление отклонено!", show_alert=True)
-        
-        # Уведомить автора объявления
-        listing = get_listing_by_id(listing_id)
-        if listing:
-            try:
-                await bot.send_message(
-                    listing[1],  # user_id
-                    f"❌ Ваше объявление '{listing[2]}' было отклонено администратором."
-                )
-            except:
-                pass
+    if action in ('approve', 'reject'):
+        status = 'approved' if action == 'approve' else 'rejected'
+        moderated = await moderate_listings([listing_id], status, callback_query.from_user.id,
+                                            author_notices=lambda moderated: format_author_notices(moderated, status))
+        outbox.wake()
+        fanout.wake()
+        invalidate_cards(listing_id)
+        if status == 'approved':
+            await warm_listing_cards([row[0] for row in moderated])
+        if not moderated:
+            await callback_query.answer("Объявление уже обработано.", show_alert=True)
+        elif status == 'approved':
+            await callback_query.answer("✅ Объявление одобрено!", show_alert=True)
+        else:
+            await callback_query.answer("❌ Объявление отклонено!", show_alert=True)
         
         await callback_query.message.edit_reply_markup()
     
     elif action == 'details':
-        listing = get_listing_by_id(listing_id)
+        listing = await get_listing_by_id(listing_id)
         if listing:
-            text = f"""
-📋 <b>Подробная информация об объявлении #{listing_id}</b>
-
-👤 <b>Автор:</b> {listing[12]} {listing[13]} (@{listing[11] if listing[11] else 'Не указан'})
-🆔 <b>ID автора:</b> {listing[1]}
-
-🛍️ <b>Название:</b> {listing[2]}
-📂 <b>Категория:</b> {CATEGORIES.get(listing[5], 'Неизвестно')}
-📄 <b>Описание:</b> {listing[3]}
-
-💰 <b>Цена магазина:</b> {listing[6]} ₽
-💵 <b>Моя цена:</b> {listing[7]} ₽
-📦 <b>Количество:</b> {listing[8]} шт.
-
-📊 <b>Статус:</b> {listing[9]}
-📅 <b>Создано:</b> {listing[10][:16] if listing[10] else 'Не указано'}
-            """
+            text, _ = get_card('details', listing)
+            text += format_details_status(listing)
             
             if listing[4]:  # photo_id
                 await callback_query.message.answer_photo(listing[4], caption=text, parse_mode='HTML')
@@ -700,9 +1220,9 @@ async def process_listing_callback(callback_query: types.CallbackQuery, callback
     listing_id = int(callback_data['listing_id'])
     
     if action == 'contact':
-        listing = get_listing_by_id(listing_id)
+        listing = await get_listing_by_id(listing_id)
         if listing:
-            seller_username = listing[11]  # обновленный индекс
+            seller_username = listing[11]
             if seller_username:
                 await callback_query.answer(
                     f"Свяжитесь с продавцом: @{seller_username}",
@@ -716,34 +1236,150 @@ async def process_listing_callback(callback_query: types.CallbackQuery, callback
         else:
             await callback_query.answer("Объявление не найдено", show_alert=True)
 
-# Уведомление администраторов о новом объявлении
-async def notify_admins_new_listing(listing_id):
-    conn = sqlite3.connect('marketplace_bot.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT user_id FROM users WHERE role = "admin"')
-    admin_ids = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    
-    listing = get_listing_by_id(listing_id)
-    if listing:
-        text = f"""
+# Inline-режим: @бот запрос в любом чате (включается в @BotFather командой /setinline).
+# Ответы кэшируются по (нормализованный запрос, offset), а одинаковые
+# запросы, пришедшие одновременно, выполняются один раз.
+inline_cache = TTLCache(INLINE_CACHE_SIZE, INLINE_CACHE_TTL)
+inline_in_flight = {}
+
+def build_inline_result(listing):
+    listing_id, title, description, photo_id, category, shop_price, my_price, quantity, username = listing
+    text, _ = get_card('catalog', listing)
+    keyboard = InlineKeyboardMarkup().add(
+        InlineKeyboardButton("💬 Связаться с продавцом", 
+                             callback_data=listing_cb.new(action='contact', listing_id=listing_id))
+    )
+    if photo_id:
+        return types.InlineQueryResultCachedPhoto(
+            id=str(listing_id), photo_file_id=photo_id, title=title,
+            caption=get_photo_caption(listing), parse_mode='HTML', reply_markup=keyboard
+        )
+    return types.InlineQueryResultArticle(
+        id=str(listing_id),
+        title=title,
+        description=f"{CATEGORIES.get(category, 'Неизвестно')} · {my_price} ₽ (в магазине {shop_price} ₽)",
+        input_message_content=types.InputTextMessageContent(text, parse_mode='HTML'),
+        reply_markup=keyboard
+    )
+
+# Пустой запрос — свежие объявления (offset — id последнего показанного),
+# иначе полнотекстовый поиск (offset — номер страницы)
+async def load_inline_results(query, offset):
+    if not query:
+        listings = await get_approved_listings(limit=INLINE_PAGE_SIZE, after_id=int(offset) if offset else None)
+        next_offset = str(listings[-1][0]) if len(listings) == INLINE_PAGE_SIZE else ''
+    else:
+        page = int(offset) if offset else 1
+        listings, has_next = await search_listings(query, INLINE_PAGE_SIZE, page)
+        next_offset = str(page + 1) if has_next else ''
+    return [build_inline_result(listing) for listing in listings], next_offset
+
+async def get_inline_results(query, offset):
+    key = (' '.join(query.lower().split()), offset)
+    cached = inline_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    
+    future = inline_in_flight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(load_inline_results(key[0], offset))
+        inline_in_flight[key] = future
+        future.add_done_callback(lambda _: inline_in_flight.pop(key, None))
+    result = await asyncio.shield(future)
+    inline_cache.set(key, result)
+    return result
+
+@dp.inline_handler()
+async def inline_catalog(inline_query: types.InlineQuery):
+    offset = inline_query.offset if inline_query.offset.isdigit() else ''
+    results, next_offset = await get_inline_results(inline_query.query[:SEARCH_QUERY_LIMIT], offset)
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TTL, next_offset=next_offset)
+
+# Тексты уведомлений. Сами уведомления записываются в таблицу outbox той же
+# транзакцией, что и изменение, а отправляет их фоновая задача outbox.
+
+# Авторам о результатах модерации. moderated — строки (id, user_id, title)
+# из moderate_listings; у автора нескольких объявлений одно сообщение.
+# Возвращает строки (chat_id, text, parse_mode) для outbox
+def format_author_notices(moderated, status):
+    titles_by_author = {}
+    for _, user_id, title in moderated:
+        titles_by_author.setdefault(user_id, []).append(title)
+    
+    if status == 'approved':
+        header = "✅ Одобрены и опубликованы ваши объявления:"
+    else:
+        header = "❌ Администратор отклонил ваши объявления:"
+    
+    return [
+        (user_id, header + "\n" + "\n".join(f"• {quote_html(title)}" for title in titles), 'HTML')
+        for user_id, titles in titles_by_author.items()
+    ]
+
+# Администраторам о новом объявлении
+def format_new_listing_notice(listing_id, title, category, username):
+    return f"""
 🔔 <b>Новое объявление для модерации!</b>
 
 📝 ID: {listing_id}
-🛍️ Название: {listing[2]}
-📂 Категория: {CATEGORIES.get(listing[5], 'Неизвестно')}
-👤 Автор: @{listing[11] if listing[11] else 'Не указан'}
+🛍️ Название: {quote_html(title)}
+📂 Категория: {CATEGORIES.get(category, 'Неизвестно')}
+👤 Автор: @{username if username else 'Не указан'}
 
 Перейдите в админ панель для модерации.
         """
-        
-        for admin_id in admin_ids:
-            try:
-                await bot.send_message(admin_id, text, parse_mode='HTML')
-            except:
-                pass
 
-if __name__ == '__main__':
+# Подписчикам категории о новом одобренном объявлении
+def format_subscription_notice(listing):
+    listing_id, user_id, title, category, shop_price, my_price, quantity = listing
+    text = f"""🔔 <b>Новое в категории {CATEGORIES.get(category, 'Неизвестно')}</b>
+
+🛍️ {quote_html(title)}
+💰 Цена магазина: {shop_price} ₽ | 💵 Моя цена: <b>{my_price} ₽</b>{format_discount(shop_price, my_price)}
+📦 Количество: {quantity} шт. | #товар_{listing_id}
+"""
+    return text, 'HTML'
+
+# Рассылка подписчикам: пачки подписчиков уходят в outbox
+fanout = FanoutJob(format_subscription_notice, on_enqueue=outbox.wake)
+
+# Запуск и остановка (общие для polling и webhook)
+async def on_startup(dp):
+    global metrics_server
     init_db()
+    await load_catalog()
+    catalog_sync.start()
+    role_sync.start()
+    if METRICS_PORT:
+        metrics_server = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+    outbox.start()
+    fanout.start()
+    archiver.start()
+    if BOT_MODE == 'webhook' and WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None)
+
+async def on_shutdown(dp):
+    # Вебхук не удаляем: пока бот перезапускается, Telegram копит обновления.
+    # Дожидаемся отправки уже поставленных в очередь сообщений;
+    # неотправленные уведомления останутся в outbox до следующего запуска
+    await fanout.close()
+    await outbox.close()
+    await archiver.close()
+    await catalog_sync.close()
+    await role_sync.close()
+    await bot.scheduler.close()
+    if metrics_server is not None:
+        await metrics_server.cleanup()
+    db.close()
+
+if __name__ == '__main__':
     print("🚀 Бот запущен!")
-    executor.start_polling(dp, skip_updates=True)
+    if BOT_WORKERS > 1:
+        from workers import run_workers
+        run_workers(bot, BOT_WORKERS, BOT_MODE, WEBHOOK_PATH, WEBAPP_HOST, WEBAPP_PORT,
+                    secret=WEBHOOK_SECRET or None, webhook_url=WEBHOOK_URL, metrics_port=METRICS_PORT)
+    elif BOT_MODE == 'webhook':
+        start_webhook(dp, WEBHOOK_PATH, WEBAPP_HOST, WEBAPP_PORT, secret=WEBHOOK_SECRET or None,
+                      on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(dp, skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
@@ -0,0 +1,192 @@
+import bisect
+import contextvars
+import functools
+import logging
+import time
+
+from aiohttp import web
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+log = logging.getLogger(__name__)
+
+# Границы корзин гистограмм, секунды
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield f'{self.name}{_labels(self.labelnames, labels)} {value}'
+
+
+# Значение вычисляется при каждом запросе /metrics
+class Gauge:
+    type = 'gauge'
+
+    def __init__(self, name, documentation, function):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        REGISTRY.append(self)
+
+    def samples(self):
+        yield f'{self.name} {self.function()}'
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [счётчики по корзинам (последняя — +Inf), сумма]
+        self.values = {}
+
+        REGISTRY.append(self)
+
+    def observe(self, seconds, *labels):
+        value = self.values.get(labels)
+        if value is None:
+            value = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        value[0][bisect.bisect_left(self.buckets, seconds)] += 1
+        value[1] += seconds
+
+    def samples(self):
+        for labels, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = _labels(self.labelnames, labels, [('le', bound)])
+                yield f'{self.name}_bucket{le} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {total}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}'
+
+
+# Все метрики в текстовом формате Prometheus
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+UPDATES = Counter('bot_updates_total', 'Полученные обновления по типу', ['type'])
+HANDLER_SECONDS = Histogram('bot_handler_seconds', 'Время обработки обновления по обработчику', ['handler'])
+HANDLER_ERRORS = Counter('bot_handler_errors_total', 'Необработанные исключения в обработчиках',
+                         ['handler', 'error'])
+DB_SECONDS = Histogram('bot_db_query_seconds', 'Время выполнения функций работы с базой', ['query'])
+DB_ERRORS = Counter('bot_db_errors_total', 'Ошибки функций работы с базой', ['query', 'error'])
+API_SECONDS = Histogram('bot_api_request_seconds', 'Время запросов к Bot API', ['method'])
+API_ERRORS = Counter('bot_api_errors_total', 'Ошибки запросов к Bot API', ['method', 'error'])
+
+
+# Декоратор для асинхронной функции: время выполнения и ошибки по её имени
+def timed(histogram, errors, name=None):
+    def decorator(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                errors.inc(label, type(e).__name__)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started, label)
+        return wrapper
+    return decorator
+
+
+# Обработчик, выбранный для текущего обновления; нужен, чтобы
+# приписать исключение конкретному обработчику
+_handler_name = contextvars.ContextVar('metrics_handler', default='unhandled')
+
+UPDATE_TYPES = ('message', 'edited_message', 'callback_query', 'inline_query')
+
+
+# Замеряет время обработки каждого обновления по обработчикам и считает ошибки
+class MetricsMiddleware(BaseMiddleware):
+    def __init__(self):
+        super().__init__()
+        for update_type in UPDATE_TYPES:
+            setattr(self, f'on_pre_process_{update_type}', self._pre_process)
+            setattr(self, f'on_process_{update_type}', self._process)
+            setattr(self, f'on_post_process_{update_type}', self._post_process)
+
+    def setup(self, manager):
+        super().setup(manager)
+        manager.dispatcher.errors_handler()(self.on_error)
+
+    async def on_pre_process_update(self, update, data):
+        _handler_name.set('unhandled')
+        for update_type in UPDATE_TYPES:
+            if getattr(update, update_type) is not None:
+                UPDATES.inc(update_type)
+                break
+        else:
+            UPDATES.inc('other')
+
+    async def _pre_process(self, event, data):
+        data['metrics_started'] = time.perf_counter()
+
+    async def _process(self, event, data):
+        handler = current_handler.get()
+        name = getattr(handler, '__name__', 'unknown')
+        data['metrics_handler'] = name
+        _handler_name.set(name)
+
+    async def _post_process(self, event, results, data):
+        started = data.get('metrics_started')
+        if started is not None:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, data.get('metrics_handler', 'unhandled'))
+
+    # Только считает ошибку; исключение дальше логирует диспетчер
+    async def on_error(self, update, error):
+        HANDLER_ERRORS.inc(_handler_name.get(), type(error).__name__)
+
+
+async def handle_metrics(request):
+    return web.Response(text=render(), content_type='text/plain', charset='utf-8',
+                        headers={'Cache-Control': 'no-cache'})
+
+
+# Отдельный небольшой HTTP-сервер с /metrics; возвращает runner для остановки
+async def start_metrics_server(host, port):
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    log.info('Метрики доступны на http://%s:%s/metrics', host, port)
+    return runner
@@ -0,0 +1,329 @@
+# Версионные миграции схемы. Текущая версия хранится в PRAGMA user_version,
+# поэтому существующие файлы marketplace_bot.db обновляются на месте.
+# Шаг миграции — SQL-строка или функция, принимающая соединение.
+
+def _schema_v1():
+    return [
+        # Таблица пользователей
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            role TEXT DEFAULT 'user',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        # Таблица объявлений
+        '''
+        CREATE TABLE IF NOT EXISTS listings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            title TEXT NOT NULL,
+            description TEXT,
+            photo_id TEXT,
+            category TEXT NOT NULL,
+            shop_price REAL NOT NULL,
+            my_price REAL NOT NULL,
+            quantity INTEGER NOT NULL,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            approved_at TIMESTAMP,
+            approved_by INTEGER,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+    ]
+
+
+def _indexes_v2():
+    return [
+        # Каталог по категории и очередь модерации: фильтр по статусу, сортировка по дате
+        'CREATE INDEX IF NOT EXISTS idx_listings_status_category_created '
+        'ON listings (status, category, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_listings_status_created '
+        'ON listings (status, created_at)',
+        # Объявления пользователя
+        'CREATE INDEX IF NOT EXISTS idx_listings_user_created '
+        'ON listings (user_id, created_at)',
+        # Поиск администраторов
+        'CREATE INDEX IF NOT EXISTS idx_users_role ON users (role)',
+    ]
+
+
+# Счётчик key меняется на delta, если выполнено условие when
+def _bump(key, delta, when='1'):
+    return (
+        f'INSERT INTO stats_counters (key, value) SELECT {key}, {delta} WHERE {when} '
+        'ON CONFLICT (key) DO UPDATE SET value = value + excluded.value;'
+    )
+
+
+# Пересчитывает счётчики статистики с нуля; исправляет возможный дрейф
+def rebuild_counters(conn):
+    conn.execute('DELETE FROM stats_counters')
+    conn.execute("INSERT INTO stats_counters SELECT 'users', COUNT(*) FROM users")
+    conn.execute(
+        "INSERT INTO stats_counters SELECT 'role:' || COALESCE(role, 'user'), COUNT(*) "
+        "FROM users GROUP BY 1"
+    )
+    conn.execute("INSERT INTO stats_counters SELECT 'listings', COUNT(*) FROM listings")
+    conn.execute(
+        "INSERT INTO stats_counters SELECT 'status:' || status, COUNT(*) "
+        "FROM listings WHERE status IS NOT NULL GROUP BY status"
+    )
+    conn.execute(
+        "INSERT INTO stats_counters SELECT 'approved:' || category, COUNT(*) "
+        "FROM listings WHERE status = 'approved' GROUP BY category"
+    )
+    # Архив появляется в миграции 6
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'listings_archive'").fetchone():
+        conn.execute("INSERT INTO stats_counters SELECT 'archived', COUNT(*) FROM listings_archive")
+
+
+def _counters_v3():
+    users_insert = _bump("'users'", 1) + _bump("'role:' || COALESCE(NEW.role, 'user')", 1)
+    users_role = (
+        _bump("'role:' || COALESCE(OLD.role, 'user')", -1)
+        + _bump("'role:' || COALESCE(NEW.role, 'user')", 1)
+    )
+    users_delete = _bump("'users'", -1) + _bump("'role:' || COALESCE(OLD.role, 'user')", -1)
+    listings_insert = (
+        _bump("'listings'", 1)
+        + _bump("'status:' || NEW.status", 1, 'NEW.status IS NOT NULL')
+        + _bump("'approved:' || NEW.category", 1, "NEW.status = 'approved'")
+    )
+    listings_update = (
+        _bump("'status:' || OLD.status", -1, 'OLD.status IS NOT NULL')
+        + _bump("'status:' || NEW.status", 1, 'NEW.status IS NOT NULL')
+        + _bump("'approved:' || OLD.category", -1, "OLD.status = 'approved'")
+        + _bump("'approved:' || NEW.category", 1, "NEW.status = 'approved'")
+    )
+    listings_delete = (
+        _bump("'listings'", -1)
+        + _bump("'status:' || OLD.status", -1, 'OLD.status IS NOT NULL')
+        + _bump("'approved:' || OLD.category", -1, "OLD.status = 'approved'")
+    )
+    return [
+        '''
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        ''',
+        'CREATE TRIGGER IF NOT EXISTS trg_users_counters_insert AFTER INSERT ON users '
+        f'BEGIN {users_insert} END',
+        'CREATE TRIGGER IF NOT EXISTS trg_users_counters_role AFTER UPDATE OF role ON users '
+        f'WHEN OLD.role IS NOT NEW.role BEGIN {users_role} END',
+        'CREATE TRIGGER IF NOT EXISTS trg_users_counters_delete AFTER DELETE ON users '
+        f'BEGIN {users_delete} END',
+        'CREATE TRIGGER IF NOT EXISTS trg_listings_counters_insert AFTER INSERT ON listings '
+        f'BEGIN {listings_insert} END',
+        'CREATE TRIGGER IF NOT EXISTS trg_listings_counters_update AFTER UPDATE OF status, category ON listings '
+        'WHEN OLD.status IS NOT NEW.status OR OLD.category IS NOT NEW.category '
+        f'BEGIN {listings_update} END',
+        'CREATE TRIGGER IF NOT EXISTS trg_listings_counters_delete AFTER DELETE ON listings '
+        f'BEGIN {listings_delete} END',
+        rebuild_counters,
+    ]
+
+
+def _search_v4():
+    # В полнотекстовом индексе лежат только одобренные объявления,
+    # поэтому поиск не тратит время на модерацию и отклонённые
+    fts_insert = (
+        'INSERT INTO listings_fts (rowid, title, description, category) '
+        "SELECT NEW.id, NEW.title, COALESCE(NEW.description, ''), NEW.category "
+        "WHERE NEW.status = 'approved';"
+    )
+    fts_delete = 'DELETE FROM listings_fts WHERE rowid = OLD.id;'
+    return [
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS listings_fts USING fts5(
+            title, description, category UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+        ''',
+        'CREATE TRIGGER IF NOT EXISTS trg_listings_fts_insert AFTER INSERT ON listings '
+        f'BEGIN {fts_insert} END',
+        'CREATE TRIGGER IF NOT EXISTS trg_listings_fts_update '
+        'AFTER UPDATE OF status, title, description, category ON listings '
+        f'BEGIN {fts_delete} {fts_insert} END',
+        'CREATE TRIGGER IF NOT EXISTS trg_listings_fts_delete AFTER DELETE ON listings '
+        f'BEGIN {fts_delete} END',
+        'DELETE FROM listings_fts',
+        '''
+        INSERT INTO listings_fts (rowid, title, description, category)
+        SELECT id, title, COALESCE(description, ''), category
+        FROM listings WHERE status = 'approved'
+        ''',
+    ]
+
+
+def _outbox_v5():
+    return [
+        # Исходящие уведомления. Пишутся в той же транзакции, что и изменение,
+        # о котором уведомляют, а отправляются фоновой задачей.
+        # status: pending -> sending (взято отправителем до next_attempt_at) -> done | failed
+        '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            parse_mode TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (next_attempt_at) '
+        "WHERE status IN ('pending', 'sending')",
+        'CREATE INDEX IF NOT EXISTS idx_outbox_status_created ON outbox (status, created_at)',
+    ]
+
+
+def _archive_v6():
+    # Отклонённые и давно опубликованные объявления переносятся из listings
+    # в архив фоновой задачей (archive.py). Удаление из listings срабатывает
+    # на триггеры счётчиков и поиска, поэтому они учитывают только живые объявления.
+    archive_insert = _bump("'archived'", 1)
+    archive_delete = _bump("'archived'", -1)
+    return [
+        'ALTER TABLE listings ADD COLUMN rejected_at TIMESTAMP',
+        '''
+        CREATE TABLE IF NOT EXISTS listings_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            title TEXT NOT NULL,
+            description TEXT,
+            photo_id TEXT,
+            category TEXT NOT NULL,
+            shop_price REAL NOT NULL,
+            my_price REAL NOT NULL,
+            quantity INTEGER NOT NULL,
+            status TEXT,
+            created_at TIMESTAMP,
+            approved_at TIMESTAMP,
+            approved_by INTEGER,
+            rejected_at TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            archive_reason TEXT
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_listings_archive_user_archived '
+        'ON listings_archive (user_id, archived_at)',
+        'CREATE TRIGGER IF NOT EXISTS trg_archive_counters_insert AFTER INSERT ON listings_archive '
+        f'BEGIN {archive_insert} END',
+        'CREATE TRIGGER IF NOT EXISTS trg_archive_counters_delete AFTER DELETE ON listings_archive '
+        f'BEGIN {archive_delete} END',
+        "INSERT OR IGNORE INTO stats_counters (key, value) VALUES ('archived', 0)",
+    ]
+
+
+def _discount_v7():
+    # Скидка относительно цены магазина для сортировки «выгоднее всего».
+    # ALTER TABLE в SQLite не добавляет STORED-столбцы, поэтому столбцы
+    # VIRTUAL: значение хранится в индексе, и сортировка по нему не вычисляет
+    # выражение для каждой строки.
+    return [
+        'ALTER TABLE listings ADD COLUMN discount REAL '
+        'GENERATED ALWAYS AS (shop_price - my_price) VIRTUAL',
+        'ALTER TABLE listings ADD COLUMN discount_percent REAL '
+        'GENERATED ALWAYS AS (ROUND((shop_price - my_price) * 100.0 / shop_price, 1)) VIRTUAL',
+        'CREATE INDEX IF NOT EXISTS idx_listings_status_category_discount '
+        'ON listings (status, category, discount_percent)',
+        'CREATE INDEX IF NOT EXISTS idx_listings_status_category_price '
+        'ON listings (status, category, my_price)',
+    ]
+
+
+def _subscriptions_v8():
+    return [
+        # Подписки на категории. Ключ (category, user_id): подписчики категории
+        # читаются по первичному ключу пачками по возрастанию user_id
+        '''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            category TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (category, user_id)
+        ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON subscriptions (user_id)',
+        # Рассылки о новых объявлениях. Задание создаётся той же транзакцией,
+        # что и одобрение; cursor — последний обработанный user_id подписчика
+        '''
+        CREATE TABLE IF NOT EXISTS fanout_jobs (
+            id INTEGER PRIMARY KEY,
+            listing_id INTEGER NOT NULL,
+            cursor INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]
+
+
+def _role_version_v9():
+    return [
+        # Версия ролей: растёт при каждой смене роли. Процессы бота сверяют её
+        # со своей и при расхождении сбрасывают кэш ролей
+        '''
+        CREATE TABLE IF NOT EXISTS role_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+        ''',
+        'INSERT OR IGNORE INTO role_version (id, version) VALUES (1, 0)',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_users_role_version AFTER UPDATE OF role ON users
+        WHEN OLD.role IS NOT NEW.role
+        BEGIN
+            UPDATE role_version SET version = version + 1 WHERE id = 1;
+        END
+        ''',
+    ]
+
+
+MIGRATIONS = [
+    (1, _schema_v1()),
+    (2, _indexes_v2()),
+    (3, _counters_v3()),
+    (4, _search_v4()),
+    (5, _outbox_v5()),
+    (6, _archive_v6()),
+    (7, _discount_v7()),
+    (8, _subscriptions_v8()),
+    (9, _role_version_v9()),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn):
+    version = get_version(conn)
+    applied = []
+    for target, steps in MIGRATIONS:
+        if target <= version:
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f'PRAGMA user_version = {int(target)}')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        applied.append(target)
+    if applied:
+        conn.execute('PRAGMA optimize')
+    return applied
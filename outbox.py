@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import random
+import time
+
+from aiogram.utils.exceptions import BadRequest, RetryAfter, Unauthorized
+
+from background import BackgroundJob
+from database import claim_notifications, finish_notifications, purge_notifications
+from metrics import Counter
+
+log = logging.getLogger(__name__)
+
+# Фоновая отправка уведомлений из таблицы outbox. Уведомления переживают
+# перезапуск бота, а при ошибке отправляются повторно с растущей паузой.
+BATCH_SIZE = 50
+# Как часто проверять очередь, если новых уведомлений не было
+POLL_INTERVAL = 5
+# На сколько секунд уведомление закрепляется за отправителем
+LEASE = 120
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 5
+BACKOFF_MAX = 60 * 60
+# Доставленные уведомления хранятся неделю
+RETENTION = 7 * 24 * 60 * 60
+PURGE_INTERVAL = 60 * 60
+
+SENT = Counter('bot_outbox_sent_total', 'Доставленные уведомления из outbox')
+RETRIED = Counter('bot_outbox_retried_total', 'Уведомления, отложенные для повторной отправки', ['error'])
+FAILED = Counter('bot_outbox_failed_total', 'Уведомления, которые не удалось доставить', ['error'])
+
+
+def backoff(attempts):
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempts)
+    return delay * random.uniform(0.5, 1)
+
+
+# wake() — проверить очередь сейчас, не дожидаясь poll_interval.
+# close() дожидается текущей пачки; недоставленное останется в таблице
+# до следующего запуска
+class OutboxSender(BackgroundJob):
+    failure_message = 'Не удалось отправить уведомления из outbox'
+
+    def __init__(self, bot, batch_size=BATCH_SIZE, poll_interval=POLL_INTERVAL, lease=LEASE,
+                 max_attempts=MAX_ATTEMPTS):
+        super().__init__(poll_interval)
+        self.bot = bot
+        self.batch_size = batch_size
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._purged_at = 0
+
+    async def step(self):
+        # Полная пачка — в очереди, вероятно, есть ещё
+        if await self.deliver_batch() == self.batch_size:
+            return 0
+        await self._purge()
+
+    # Отправляет одну пачку уведомлений; возвращает, сколько их было взято
+    async def deliver_batch(self):
+        rows = await claim_notifications(self.batch_size, self.lease)
+        if not rows:
+            return 0
+
+        # Темп отправки и повторы при flood control обеспечивает планировщик бота
+        results = await asyncio.gather(
+            *(self.bot.send_message(chat_id, text, parse_mode=parse_mode)
+              for _, chat_id, text, parse_mode, _ in rows),
+            return_exceptions=True
+        )
+
+        done, retry, failed = [], [], []
+        now = time.time()
+        for (outbox_id, chat_id, _, _, attempts), result in zip(rows, results):
+            if not isinstance(result, Exception):
+                done.append(outbox_id)
+                continue
+            error = f'{type(result).__name__}: {result}'
+            # Бот заблокирован, чат не найден, ошибка в тексте — повтор не поможет
+            if isinstance(result, (Unauthorized, BadRequest)) or attempts + 1 >= self.max_attempts:
+                log.warning('Не удалось доставить уведомление %s в чат %s: %s', outbox_id, chat_id, error)
+                FAILED.inc(type(result).__name__)
+                failed.append((outbox_id, error))
+            else:
+                delay = result.timeout if isinstance(result, RetryAfter) else backoff(attempts)
+                RETRIED.inc(type(result).__name__)
+                retry.append((outbox_id, now + delay, error))
+
+        await finish_notifications(done, retry, failed)
+        SENT.inc(amount=len(done))
+        return len(rows)
+
+    async def _purge(self):
+        if time.monotonic() - self._purged_at < PURGE_INTERVAL:
+            return
+        self._purged_at = time.monotonic()
+        try:
+            purged = await purge_notifications(RETENTION)
+            if purged:
+                log.info('Удалено доставленных уведомлений: %s', purged)
+        except Exception:
+            log.exception('Не удалось очистить outbox')
@@ -0,0 +1,111 @@
+import asyncio
+import collections
+import cProfile
+import io
+import logging
+import os
+import pstats
+import statistics
+import time
+from datetime import datetime
+
+log = logging.getLogger(__name__)
+
+# Профилирование работающего бота без перезапуска: cProfile на время
+# сессии включается в потоке цикла событий, параллельно замеряются задержка
+# цикла и число задач asyncio. Потоки базы данных в профиль не попадают.
+PROFILE_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+TOP_N = 40
+# Как часто замерять задержку цикла событий и считать задачи
+LAG_INTERVAL = 0.1
+
+# Одновременно может идти только одна сессия: cProfile на поток один
+_session = None
+
+
+def is_running():
+    return _session is not None and not _session.done()
+
+
+def _coroutine_name(task):
+    coro = task.get_coro()
+    return getattr(coro, '__qualname__', type(coro).__name__)
+
+
+async def _watch_loop(stop, lags, task_counts):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append(loop.time() - started - LAG_INTERVAL)
+        task_counts.append(len(asyncio.all_tasks()))
+
+
+def _format_lags(lags):
+    if not lags:
+        return 'нет замеров'
+    lags = sorted(lags)
+    p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+    return (f'среднее {statistics.fmean(lags) * 1000:.1f} мс, медиана {statistics.median(lags) * 1000:.1f} мс, '
+            f'p99 {p99 * 1000:.1f} мс, максимум {lags[-1] * 1000:.1f} мс')
+
+
+# Профилирует цикл событий seconds секунд. Возвращает (краткая сводка, полный отчёт)
+async def profile_loop(seconds, top=TOP_N):
+    tasks_before = collections.Counter(_coroutine_name(task) for task in asyncio.all_tasks())
+    lags, task_counts = [], []
+    stop = asyncio.Event()
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+
+    profiler.enable()
+    try:
+        watcher = asyncio.ensure_future(_watch_loop(stop, lags, task_counts))
+        await asyncio.sleep(seconds)
+        stop.set()
+        await watcher
+    finally:
+        profiler.disable()
+    elapsed = time.perf_counter() - started
+
+    tasks_after = collections.Counter(_coroutine_name(task) for task in asyncio.all_tasks())
+    summary = (
+        f'⏱ Профиль за {elapsed:.0f} с (pid {os.getpid()})\n'
+        f'Задачи asyncio: в начале {sum(tasks_before.values())}, '
+        f'максимум {max(task_counts, default=0)}, в конце {sum(tasks_after.values())}\n'
+        f'Задержка цикла событий: {_format_lags(lags)}'
+    )
+
+    report = io.StringIO()
+    report.write(f'{summary}\n{datetime.now():%Y-%m-%d %H:%M:%S}\n\n')
+    report.write('Задержка цикла замерялась при включённом cProfile, без него она ниже.\n\n')
+    report.write('Задачи asyncio в конце сессии по корутинам:\n')
+    for name, count in tasks_after.most_common(top):
+        report.write(f'{count:>8}  {name}\n')
+
+    stats = pstats.Stats(profiler, stream=report)
+    stats.strip_dirs()
+    report.write(f'\n=== Top {top} по собственному времени (tottime) ===\n')
+    stats.sort_stats('tottime').print_stats(top)
+    report.write(f'\n=== Top {top} по суммарному времени (cumtime) ===\n')
+    stats.sort_stats('cumulative').print_stats(top)
+    return summary, report.getvalue()
+
+
+# Запускает сессию в фоне; done(summary, report) вызывается по окончании.
+# Возвращает False, если сессия уже идёт
+def start_profile(seconds, done):
+    global _session
+    if is_running():
+        return False
+
+    async def run():
+        try:
+            summary, report = await profile_loop(seconds)
+            await done(summary, report)
+        except Exception:
+            log.exception('Не удалось выполнить профилирование')
+
+    _session = asyncio.ensure_future(run())
+    return True
@@ -0,0 +1,141 @@
+import bisect
+import operator
+import sys
+
+from background import BackgroundJob
+
+# Одобренные объявления в памяти процесса: каталог читается без запросов к
+# базе. Модель загружается при запуске, обновляется функциями записи в
+# database.py и периодически сверяется с базой (другие процессы пишут в ту же базу).
+
+# Карточки каталога показывают не больше 200 символов описания, поэтому
+# хранить его целиком не нужно; так память на объявление ограничена
+DESCRIPTION_LIMIT = 256
+SYNC_INTERVAL = 60
+
+
+class CatalogRecord:
+    __slots__ = ('id', 'title', 'description', 'photo_id', 'category', 'shop_price', 'my_price',
+                 'quantity', 'username', 'created_at', 'discount_percent')
+
+    def __init__(self, row):
+        (self.id, self.title, description, self.photo_id, category, self.shop_price, self.my_price,
+         self.quantity, username, self.created_at, discount_percent) = row
+        self.description = description[:DESCRIPTION_LIMIT] if description else description
+        # Категорий несколько, продавцов меньше, чем объявлений: строки общие
+        self.category = sys.intern(category)
+        self.username = sys.intern(username) if username else username
+        # NULL в SQLite меньше любого числа
+        self.discount_percent = discount_percent if discount_percent is not None else float('-inf')
+
+    # Строка в том же виде, что и страница каталога из базы
+    def row(self):
+        return (self.id, self.title, self.description, self.photo_id, self.category, self.shop_price,
+                self.my_price, self.quantity, self.username)
+
+
+class CatalogReadModel:
+    # sorts: {сортировка: (столбец, 'ASC' | 'DESC')}; столбец — атрибут CatalogRecord
+    def __init__(self, sorts):
+        self.sorts = {
+            name: (operator.attrgetter(column, 'id'), order == 'DESC')
+            for name, (column, order) in sorts.items()
+        }
+        self.loaded = False
+        self._by_id = {}
+        # (категория, сортировка) -> записи по возрастанию ключа сортировки;
+        # категория None — все одобренные объявления
+        self._lists = {}
+        # Сумма id — для сверки с базой
+        self.checksum = 0
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def load(self, rows):
+        by_id = {}
+        for row in rows:
+            record = CatalogRecord(row)
+            by_id[record.id] = record
+        lists = {}
+        for name, (key, _) in self.sorts.items():
+            ordered = sorted(by_id.values(), key=key)
+            lists[(None, name)] = ordered
+            for record in ordered:
+                lists.setdefault((record.category, name), []).append(record)
+        self._by_id, self._lists, self.checksum = by_id, lists, sum(by_id)
+        self.loaded = True
+
+    def clear(self):
+        self._by_id, self._lists, self.checksum = {}, {}, 0
+        self.loaded = False
+
+    def add(self, row):
+        record = CatalogRecord(row)
+        self.remove(record.id)
+        self._by_id[record.id] = record
+        self.checksum += record.id
+        for name, (key, _) in self.sorts.items():
+            for category in (None, record.category):
+                bisect.insort(self._lists.setdefault((category, name), []), record, key=key)
+
+    def remove(self, listing_id):
+        record = self._by_id.pop(listing_id, None)
+        if record is None:
+            return
+        self.checksum -= listing_id
+        for name, (key, _) in self.sorts.items():
+            for category in (None, record.category):
+                items = self._lists[(category, name)]
+                index = bisect.bisect_left(items, key(record), key=key)
+                if index < len(items) and items[index] is record:
+                    del items[index]
+
+    # То же, что get_catalog_page: (строки, есть_предыдущая, есть_следующая).
+    # category None — все категории
+    def page(self, category, page_size, direction='first', cursor_id=None, sort='new'):
+        key, descending = self.sorts[sort]
+        items = self._lists.get((category, sort), [])
+        count = len(items)
+
+        # Позиция в порядке показа: для убывающей сортировки список читается с конца
+        def window(start, stop):
+            if descending:
+                return [items[count - 1 - i].row() for i in range(start, stop)]
+            return [record.row() for record in items[start:stop]]
+
+        if direction == 'first':
+            return window(0, min(page_size, count)), False, count > page_size
+
+        # Как и запрос к базе: если объявления-курсора больше нет (например,
+        # ушло в архив) или за ним пусто — первая страница
+        record = self._by_id.get(cursor_id)
+        if record is not None and (category is None or record.category == category):
+            position = bisect.bisect_left(items, key(record), key=key)
+            if descending:
+                position = count - 1 - position
+
+            if direction == 'prev' and position > 0:
+                start = max(0, position - page_size)
+                return window(start, position), start > 0, True
+            start = position + 1 if direction == 'next' else position
+            if direction != 'prev' and start < count:
+                stop = min(start + page_size, count)
+                return window(start, stop), True, stop < count
+        return self.page(category, page_size, 'first', None, sort)
+
+    # Все одобренные объявления категории (или всех категорий), новые первыми
+    def rows(self, category=None):
+        return [record.row() for record in reversed(self._lists.get((category, 'new'), []))]
+
+
+# Периодическая сверка модели с базой; sync — корутина из database.py
+class CatalogSync(BackgroundJob):
+    failure_message = 'Не удалось сверить каталог с базой'
+
+    def __init__(self, sync, interval=SYNC_INTERVAL):
+        super().__init__(interval)
+        self.sync = sync
+
+    async def step(self):
+        await self.sync()
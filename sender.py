@@ -0,0 +1,204 @@
+import asyncio
+import collections
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter
+
+from metrics import API_ERRORS, API_SECONDS
+
+log = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота и ~1 в секунду в один чат
+GLOBAL_RATE = 30
+GLOBAL_BURST = 30
+CHAT_RATE = 1
+CHAT_BURST = 3
+WORKERS = 8
+MAX_RETRIES = 5
+
+# Методы Bot API, которые отправляют или меняют сообщения в чате
+CHAT_METHODS = {
+    'sendMessage', 'sendPhoto', 'sendDocument', 'sendMediaGroup', 'sendChatAction',
+    'copyMessage', 'forwardMessage', 'editMessageText', 'editMessageCaption',
+    'editMessageMedia', 'editMessageReplyMarkup', 'deleteMessage',
+}
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Забирает токен заранее и возвращает, сколько секунд нужно подождать
+    def reserve(self):
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_full(self):
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ('factory', 'future', 'attempts')
+
+    def __init__(self, factory, future):
+        self.factory = factory
+        self.future = future
+        self.attempts = 0
+
+
+# Очередь исходящих запросов. У каждого чата своя очередь и свой токен-бакет,
+# в работе одновременно не больше одного запроса на чат, поэтому порядок
+# сообщений внутри чата сохраняется. Воркеры ограничивают общую
+# параллельность и дополнительно делят глобальный бакет.
+class OutboundScheduler:
+    def __init__(self, global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST,
+                 chat_rate=CHAT_RATE, chat_burst=CHAT_BURST, workers=WORKERS):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self._chats = {}
+        self._buckets = {}
+        self._active = set()
+        self._ready = None
+        self._tasks = []
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    # Количество запросов, ожидающих отправки
+    @property
+    def depth(self):
+        return sum(len(jobs) for jobs in self._chats.values())
+
+    def _start(self):
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                self._buckets = {key: value for key, value in self._buckets.items()
+                                 if key in self._active or not value.is_full()}
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _schedule(self, chat_id, delay=None):
+        if delay is None:
+            delay = self._chat_bucket(chat_id).reserve()
+        self._active.add(chat_id)
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, chat_id)
+        else:
+            self._ready.put_nowait(chat_id)
+
+    # Ставит запрос в очередь; factory — функция, возвращающая корутину
+    def submit(self, chat_id, factory):
+        self._start()
+        future = asyncio.get_running_loop().create_future()
+        self._chats.setdefault(chat_id, collections.deque()).append(_Job(factory, future))
+        if chat_id not in self._active:
+            self._schedule(chat_id)
+        return future
+
+    async def send(self, chat_id, factory):
+        return await self.submit(chat_id, factory)
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            jobs = self._chats[chat_id]
+            job = jobs[0]
+            delay = self.global_bucket.reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            retry_after = None
+            try:
+                result = await job.factory()
+            except RetryAfter as e:
+                job.attempts += 1
+                if job.attempts <= MAX_RETRIES:
+                    retry_after = e.timeout
+                    self.retried += 1
+                    log.warning('Flood control for chat %s, retry in %s s', chat_id, e.timeout)
+                else:
+                    self._finish(jobs, job, error=e)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._finish(jobs, job, error=e)
+            else:
+                self._finish(jobs, job, result=result)
+
+            if retry_after is not None:
+                self._schedule(chat_id, retry_after)
+            elif jobs:
+                self._schedule(chat_id)
+            else:
+                del self._chats[chat_id]
+                self._active.discard(chat_id)
+
+    def _finish(self, jobs, job, result=None, error=None):
+        jobs.popleft()
+        if error is not None:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(error)
+        else:
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+
+    # Дожидается отправки всего, что уже в очереди, и останавливает воркеров
+    async def close(self, timeout=10):
+        if not self._tasks:
+            return
+        pending = [job.future for jobs in self._chats.values() for job in jobs]
+        if pending:
+            await asyncio.wait(pending, timeout=timeout)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+# Бот, у которого все запросы в чаты проходят через планировщик
+class ScheduledBot(Bot):
+    def __init__(self, *args, scheduler=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.scheduler = scheduler or OutboundScheduler()
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        chat_id = (data or {}).get('chat_id')
+        if method not in CHAT_METHODS or chat_id is None:
+            return await self._timed_request(method, data, files, **kwargs)
+        return await self.scheduler.send(
+            chat_id, lambda: self._timed_request(method, data, files, **kwargs)
+        )
+
+    # Сам HTTP-запрос без ожидания в очереди; время и ошибки идут в метрики bot_api_*
+    async def _timed_request(self, method, data, files, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().request(method, data, files, **kwargs)
+        except Exception as e:
+            API_ERRORS.inc(method, type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, method)
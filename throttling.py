@@ -0,0 +1,119 @@
+import collections
+import logging
+import time
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler, current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.utils.exceptions import TelegramAPIError
+
+from metrics import Counter
+
+log = logging.getLogger(__name__)
+
+# Ограничение частоты запросов пользователя: скользящее окно на пару
+# (пользователь, обработчик). Лимит обработчика задаётся декоратором throttle,
+# остальным достаётся лимит по умолчанию.
+DEFAULT_LIMIT = 20
+DEFAULT_WINDOW = 10
+# Как часто удалять окна неактивных пользователей; окна длиннее не задавать
+SWEEP_INTERVAL = 60
+THROTTLED_TEXT = "⏳ Слишком много запросов, подождите немного."
+
+THROTTLED = Counter('bot_throttled_total', 'Отброшенные обновления по обработчику и причине',
+                    ['handler', 'reason'])
+
+
+# Не больше limit вызовов обработчика за window секунд от одного пользователя.
+# Обработчики с одинаковым key делят одно окно (например, шаги мастера)
+def throttle(limit, window, key=None):
+    def decorator(handler):
+        handler.throttling = (limit, window, key)
+        return handler
+    return decorator
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self, limit=DEFAULT_LIMIT, window=DEFAULT_WINDOW):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        # (user_id, ключ) -> времена вызовов в окне
+        self._hits = {}
+        # (user_id, ключ) -> до какого времени не предупреждать повторно
+        self._warned = {}
+        # Запросы, которые сейчас обрабатываются: одинаковый повторный
+        # запрос того же пользователя не выполняется второй раз
+        self._in_flight = set()
+        self._swept_at = time.monotonic()
+
+    async def on_process_message(self, message, data):
+        request = ('message', message.chat.id, message.text) if message.text else None
+        await self._check(message, data, message.from_user.id, request)
+
+    async def on_process_callback_query(self, callback_query, data):
+        await self._check(callback_query, data, callback_query.from_user.id, ('callback_query', callback_query.data))
+
+    async def on_post_process_message(self, message, results, data):
+        self._release(data)
+
+    async def on_post_process_callback_query(self, callback_query, results, data):
+        self._release(data)
+
+    async def _check(self, event, data, user_id, request):
+        handler = current_handler.get()
+        name = getattr(handler, '__name__', 'unknown')
+        limit, window, key = getattr(handler, 'throttling', (self.limit, self.window, None))
+        key = (user_id, key or name)
+
+        if request is not None:
+            request = (user_id,) + request
+            # Тот же запрос уже выполняется — только подтверждаем нажатие
+            if request in self._in_flight and data.get('throttling_request') != request:
+                THROTTLED.inc(name, 'duplicate')
+                if isinstance(event, types.CallbackQuery):
+                    await self._answer(event)
+                raise CancelHandler()
+
+        now = time.monotonic()
+        self._sweep(now)
+        hits = self._hits.get(key)
+        if hits is None:
+            hits = self._hits[key] = collections.deque()
+        while hits and hits[0] <= now - window:
+            hits.popleft()
+        if len(hits) >= limit:
+            THROTTLED.inc(name, 'rate')
+            if isinstance(event, types.CallbackQuery):
+                await self._answer(event, THROTTLED_TEXT)
+            elif self._warned.get(key, 0) <= now:
+                # Предупреждаем один раз за окно, чтобы не отвечать на каждое сообщение
+                self._warned[key] = now + window
+                await self._answer(event, THROTTLED_TEXT)
+            raise CancelHandler()
+        hits.append(now)
+
+        if request is not None:
+            self._in_flight.add(request)
+            data['throttling_request'] = request
+
+    def _release(self, data):
+        request = data.get('throttling_request')
+        if request is not None:
+            self._in_flight.discard(request)
+
+    def _sweep(self, now):
+        if now - self._swept_at < SWEEP_INTERVAL:
+            return
+        self._swept_at = now
+        for key in [key for key, hits in self._hits.items() if not hits or hits[-1] <= now - SWEEP_INTERVAL]:
+            del self._hits[key]
+        for key in [key for key, until in self._warned.items() if until <= now]:
+            del self._warned[key]
+
+    @staticmethod
+    async def _answer(event, text=None):
+        try:
+            await event.answer(text)
+        except TelegramAPIError:
+            log.debug('Не удалось ответить на отброшенное обновление', exc_info=True)
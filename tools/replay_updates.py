@@ -0,0 +1,47 @@
+import argparse
+import json
+import sys
+import urllib.error
+import urllib.request
+
+# Отправляет записанные обновления (по одному JSON-объекту на строку)
+# на локальный вебхук бота:
+#     python tools/replay_updates.py updates.jsonl --url http://127.0.0.1:8080/webhook
+
+
+def post_update(url, update, secret=None):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode(),
+        headers={'Content-Type': 'application/json'},
+        method='POST',
+    )
+    if secret:
+        request.add_header('X-Telegram-Bot-Api-Secret-Token', secret)
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.code, e.reason
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Отправка записанных обновлений на вебхук')
+    parser.add_argument('file', help='файл JSONL с обновлениями, "-" — stdin')
+    parser.add_argument('--url', default='http://127.0.0.1:8080/webhook')
+    parser.add_argument('--secret', default=None)
+    args = parser.parse_args()
+
+    source = sys.stdin if args.file == '-' else open(args.file, encoding='utf-8')
+    with source:
+        for line in source:
+            line = line.strip()
+            if not line:
+                continue
+            update = json.loads(line)
+            status, body = post_update(args.url, update, args.secret)
+            print(update.get('update_id'), status, body)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import math
+
+# Правила проверки полей объявления. Общие для пошагового создания
+# объявления и для загрузки файлом; при ошибке — ValueError.
+
+# Длиннее карточки не помещаются в подпись к фото и в страницу каталога
+TITLE_MAX_LENGTH = 100
+DESCRIPTION_MAX_LENGTH = 500
+
+
+def parse_title(value):
+    title = str(value).strip()
+    if not title or len(title) > TITLE_MAX_LENGTH:
+        raise ValueError(value)
+    return title
+
+
+def parse_description(value):
+    description = str(value).strip()
+    if len(description) > DESCRIPTION_MAX_LENGTH:
+        raise ValueError(value)
+    return description
+
+
+def parse_price(value):
+    price = float(str(value).strip().replace(',', '.'))
+    if not math.isfinite(price) or price <= 0:
+        raise ValueError(value)
+    return price
+
+
+def parse_quantity(value):
+    quantity = int(str(value).strip())
+    if quantity <= 0:
+        raise ValueError(value)
+    return quantity
+
+
+# Категория по ключу (electronics) или по названию из меню (📱 Электроника)
+def parse_category(value, categories):
+    value = str(value).strip()
+    if value in categories:
+        return value
+    for key, name in categories.items():
+        if value == name:
+            return key
+    raise ValueError(value)
@@ -0,0 +1,37 @@
+import hmac
+
+from aiohttp import web
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+from aiogram.utils.executor import Executor
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+SECRET_KEY = 'WEBHOOK_SECRET'
+
+
+# Пропускает запрос, если секрет не задан или заголовок с ним совпадает
+def check_secret(request, secret):
+    if secret:
+        received = request.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(received, secret):
+            raise web.HTTPForbidden()
+
+
+# Обработчик вебхука, который отклоняет запросы без правильного секретного токена
+class SecretWebhookHandler(WebhookRequestHandler):
+    async def post(self):
+        check_secret(self.request, self.request.app.get(SECRET_KEY))
+        return await super().post()
+
+
+# Запуск в режиме вебхука на aiohttp. Обработчики те же, что и при polling:
+# сервер лишь принимает обновления и передаёт их в диспетчер.
+def start_webhook(dispatcher, path, host, port, secret=None, on_startup=None, on_shutdown=None):
+    executor = Executor(dispatcher)
+    if on_startup is not None:
+        executor.on_startup(on_startup, polling=False)
+    if on_shutdown is not None:
+        executor.on_shutdown(on_shutdown, polling=False)
+
+    executor.set_webhook(webhook_path=path, request_handler=SecretWebhookHandler)
+    executor.web_app[SECRET_KEY] = secret
+    executor.run_app(host=host, port=port)
@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+
+from database import init_db
+from sender import GLOBAL_BURST, GLOBAL_RATE, OutboundScheduler
+from webhook_server import check_secret
+
+log = logging.getLogger(__name__)
+
+# Обработка обновлений в нескольких процессах. Один процесс-приёмник получает
+# обновления (polling или вебхук) и раздаёт их N рабочим процессам по
+# from_user.id, поэтому все обновления одного пользователя обрабатывает один
+# процесс и по порядку. База и состояния FSM общие: SQLite в режиме WAL
+# допускает несколько процессов, запись в каждом идёт через один поток.
+
+# Сколько обновлений рабочий процесс обрабатывает одновременно
+WORKER_CONCURRENCY = 100
+POLLING_TIMEOUT = 20
+# Сколько ждать завершения рабочих процессов при остановке
+SHUTDOWN_TIMEOUT = 30
+
+
+# Пользователь, от которого пришло обновление; если его нет — чат
+def partition_key(update):
+    for key, value in update.items():
+        if key == 'update_id' or not isinstance(value, dict):
+            continue
+        user = value.get('from') or value.get('user')
+        if user:
+            return user['id']
+        chat = value.get('chat') or value.get('message', {}).get('chat')
+        if chat:
+            return chat['id']
+    return 0
+
+
+# Обработка одного обновления после предыдущего обновления того же пользователя
+async def _process(dp, data, previous, semaphore):
+    try:
+        if previous is not None:
+            await asyncio.wait([previous])
+        await dp.process_updates([types.Update(**data)])
+    except Exception:
+        log.exception('Ошибка при обработке обновления %s', data.get('update_id'))
+    finally:
+        semaphore.release()
+
+
+async def _worker_loop(index, queue, workers, metrics_port):
+    import main
+    from metrics import start_metrics_server
+
+    # Лимит Telegram на бота общий, поэтому делим его между процессами
+    main.bot.scheduler = OutboundScheduler(
+        global_rate=GLOBAL_RATE / workers, global_burst=max(1, GLOBAL_BURST // workers)
+    )
+    Bot.set_current(main.bot)
+    Dispatcher.set_current(main.dp)
+    if metrics_port:
+        main.metrics_server = await start_metrics_server(main.METRICS_HOST, metrics_port + index)
+    main.outbox.start()
+    # Каталог в памяти у каждого процесса свой
+    await main.load_catalog()
+    main.catalog_sync.start()
+    # Кэш ролей тоже свой: make_admin в другом процессе его не сбрасывает
+    main.role_sync.start()
+    # Архивация и рассылка работают с общей базой, достаточно одного процесса
+    if index == 0:
+        main.fanout.start()
+        main.archiver.start()
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(WORKER_CONCURRENCY)
+    chains = {}
+
+    def forget(key, task):
+        if chains.get(key) is task:
+            del chains[key]
+
+    log.info('Рабочий процесс %s запущен', index)
+    while True:
+        await semaphore.acquire()
+        data = await loop.run_in_executor(None, queue.get)
+        if data is None:
+            semaphore.release()
+            break
+        key = partition_key(data)
+        task = asyncio.ensure_future(_process(main.dp, data, chains.get(key), semaphore))
+        chains[key] = task
+        task.add_done_callback(lambda task, key=key: forget(key, task))
+
+    await asyncio.gather(*chains.values(), return_exceptions=True)
+    await main.on_shutdown(main.dp)
+    await main.dp.storage.close()
+    await (await main.bot.get_session()).close()
+    log.info('Рабочий процесс %s остановлен', index)
+
+
+def _worker_main(index, queue, workers, metrics_port):
+    # Ctrl+C получает вся группа процессов; рабочие останавливает приёмник
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker_loop(index, queue, workers, metrics_port))
+
+
+class Receiver:
+    def __init__(self, bot, queues):
+        self.bot = bot
+        self.queues = queues
+
+    def dispatch(self, update):
+        self.queues[partition_key(update) % len(self.queues)].put(update)
+
+    async def poll(self, skip_updates=True):
+        await self.bot.delete_webhook(drop_pending_updates=skip_updates)
+        payload = {'timeout': POLLING_TIMEOUT}
+        while True:
+            try:
+                # Сырые словари: приёмнику не нужно разбирать обновления в объекты
+                updates = await self.bot.request('getUpdates', payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception('Не удалось получить обновления')
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                self.dispatch(update)
+                payload['offset'] = update['update_id'] + 1
+
+    def webhook_app(self, path, secret=None):
+        async def handle(request):
+            check_secret(request, secret)
+            self.dispatch(await request.json())
+            return web.json_response({})
+
+        app = web.Application()
+        app.router.add_post(path, handle)
+        return app
+
+
+async def _receive(receiver, mode, webhook_path, host, port, secret, webhook_url):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    runner = polling = None
+    if mode == 'webhook':
+        runner = web.AppRunner(receiver.webhook_app(webhook_path, secret), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        if webhook_url:
+            await receiver.bot.set_webhook(webhook_url + webhook_path, secret_token=secret)
+    else:
+        polling = asyncio.ensure_future(receiver.poll())
+
+    await stop.wait()
+    if polling is not None:
+        polling.cancel()
+        await asyncio.gather(polling, return_exceptions=True)
+    if runner is not None:
+        await runner.cleanup()
+    await (await receiver.bot.get_session()).close()
+
+
+# Запускает приёмник в текущем процессе и workers рабочих процессов
+def run_workers(bot, workers, mode='polling', webhook_path='/webhook', host='127.0.0.1', port=8080,
+                secret=None, webhook_url='', metrics_port=0):
+    # Миграции выполняются один раз, до запуска рабочих процессов
+    init_db()
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue() for _ in range(workers)]
+    processes = [
+        context.Process(target=_worker_main, args=(index, queue, workers, metrics_port),
+                        name=f'bot-worker-{index}')
+        for index, queue in enumerate(queues)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        asyncio.run(_receive(Receiver(bot, queues), mode, webhook_path, host, port, secret, webhook_url))
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join(SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                log.warning('Рабочий процесс %s не остановился, завершаем', process.name)
+                process.terminate()